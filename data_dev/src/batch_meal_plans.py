@@ -0,0 +1,87 @@
+import os.path
+
+import numpy as np
+import pandas as pd
+
+from common import REPO_DATA_DIR
+from diet_solver import solve_diets
+from food_composition import FoodComposition, get_food_composition
+from meal_plan import FOOD_GROUP_LIMITS, NUTRIENT_COLUMNS
+from nutrient_requirements import NUTRIENT_NEEDS_CSV, REGION_COLUMN
+from population_store import PopulationStore, get_population_store
+
+NUTRIENT_NEEDS_URL = 'https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/data/result_sum_adj_df.csv'
+MEAL_PLANS_CSV = os.path.join(REPO_DATA_DIR, 'meal_plans.csv')
+
+
+def get_per_capita_needs(nutrient_needs_df: pd.DataFrame,
+                         population_store: PopulationStore) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stack the per capita daily nutrient needs of every (region, year) row of the nutrient needs table
+
+    :param nutrient_needs_df: Total daily needs per region and year (result_sum_adj_df), with the region and year
+                              as the first two columns, followed by one column per nutrient
+    :param population_store: Population per region and year, see population_store.get_population_store.
+                             Regions without population data use a population of 1, like the Streamlit app
+    :return: Population per row, and the per capita needs with shape (rows x nutrients)
+    """
+
+    keys = zip(nutrient_needs_df[REGION_COLUMN], nutrient_needs_df['Year'])
+    population = np.array([population_store.get(region, year, default=1) for region, year in keys], dtype=float)
+
+    total_needs = nutrient_needs_df[nutrient_needs_df.columns[2:]].to_numpy(dtype=float)
+    return population, total_needs / population[:, None]
+
+
+def solve_all_meal_plans(nutrient_needs_df: pd.DataFrame, population_store: PopulationStore = None,
+                         food_composition: FoodComposition = None, food_group_limits: dict[str, float] = None,
+                         processes: int = None) -> pd.DataFrame:
+    """
+    Solve the exact meal plan (see diet_solver.solve_diet) for every (region, year) of the nutrient needs table.
+    All per capita needs are stacked into one matrix and solved against the same food composition matrix
+
+    :param nutrient_needs_df: Total daily needs per region and year, see get_per_capita_needs
+    :param population_store: Population per region and year. If None, the store of UN_PPP2024_Output_PopTot.csv
+                             is loaded
+    :param food_composition: Food composition matrix. If None, the precompiled WAFCT matrix is loaded
+    :param food_group_limits: Daily gram limits per FOOD TYPE. If None, FOOD_GROUP_LIMITS is used
+    :param processes: Number of worker processes, see diet_solver.solve_diets
+    :return: One row per (region, year), with the population, the fulfillment (%) per nutrient,
+             and the grams per capita per day of every food item that is used in at least one meal plan
+    """
+
+    population_store = population_store or get_population_store()
+    food_composition = food_composition or get_food_composition()
+    food_group_limits = food_group_limits or FOOD_GROUP_LIMITS
+    nutrients = list(nutrient_needs_df.columns[2:])
+    # Like in the Streamlit app, only the NUTRIENT_COLUMNS of the food items count towards the needs
+    A = food_composition.columns([NUTRIENT_COLUMNS.get(nutrient) for nutrient in nutrients])
+    group_indices = food_composition.group_indices(food_group_limits)
+    population, per_capita_needs = get_per_capita_needs(nutrient_needs_df, population_store)
+
+    grams = solve_diets(A, per_capita_needs, list(group_indices.values()), np.array(list(food_group_limits.values())),
+                        processes=processes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fulfillment = np.where(per_capita_needs > 0, grams @ A / 100 / per_capita_needs * 100, np.nan)
+
+    used_foods = np.flatnonzero(grams.max(axis=0, initial=0) > 0)
+    food_names = pd.Series(food_composition.food_names[used_foods])
+    duplicated = food_names.duplicated(keep=False).to_numpy()
+    food_codes = np.array(food_composition.header['food_codes'], dtype=object)[used_foods]
+    food_columns = [f'{name} ({code})' if is_duplicate else name
+                    for name, code, is_duplicate in zip(food_names, food_codes, duplicated)]
+
+    return pd.concat([
+        nutrient_needs_df[[REGION_COLUMN, 'Year']].reset_index(drop=True),
+        pd.DataFrame({'Population': population}),
+        pd.DataFrame(fulfillment, columns=[f'{nutrient} (%)' for nutrient in nutrients]),
+        pd.DataFrame(grams[:, used_foods], columns=food_columns),
+    ], axis=1)
+
+
+if __name__ == '__main__':
+    nutrient_needs_source = NUTRIENT_NEEDS_CSV if os.path.exists(NUTRIENT_NEEDS_CSV) else NUTRIENT_NEEDS_URL
+    meal_plans = solve_all_meal_plans(pd.read_csv(nutrient_needs_source))
+    meal_plans.to_csv(MEAL_PLANS_CSV, index=False)
+    print(f'Successfully written {len(meal_plans)} meal plans to {MEAL_PLANS_CSV}')
@@ -4,6 +4,8 @@ import os.path
 SRC_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.dirname(SRC_DIR)
 DATA_DIR = os.path.join(ROOT_DIR, 'data')
+REPO_DIR = os.path.dirname(ROOT_DIR)
+REPO_DATA_DIR = os.path.join(REPO_DIR, 'data')
 JSON = None | bool | int | float | str | list['JSON'] | dict[str, 'JSON']
 
 
@@ -11,3 +13,12 @@ def get_secret(secret_key: str) -> JSON:
     with open(os.path.join(SRC_DIR, 'secrets.json')) as f:
         secrets = json.load(f)
     return secrets[secret_key]
+
+
+def file_fingerprint(path: str) -> dict:
+    """
+    Name, size and modification time of a file, which change when the file is regenerated
+    """
+
+    stat = os.stat(path)
+    return {'name': os.path.basename(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
@@ -0,0 +1,178 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Problem shared by all targets in a worker process of solve_diets, set once by _init_worker
+_worker_problem = None
+
+
+def solve_diet(A: np.ndarray, targets: np.ndarray, group_indices: list[np.ndarray], group_limits: np.ndarray,
+               excess_weight: float = 0.1, max_iterations: int = 10_000) -> np.ndarray:
+    """
+    Find the grams per food that best meet the nutrient targets, within the food group limits
+
+    The diet is solved exactly as a bounded linear program:
+        minimize    sum over nutrients of shortfall_n + excess_weight * excess_n
+        subject to  grams @ A / 100 / target_n + shortfall_n - excess_n = 1 for every nutrient n
+                    per group: sum of grams of its foods <= group limit
+                    grams, shortfall, excess >= 0
+    where shortfall_n and excess_n are the relative deviations below and above the target of nutrient n.
+    The targets thus act as (soft) lower bounds, while overshooting them is penalized less.
+    Since the optimum is a vertex of the feasible set, at most (nutrients + groups) foods are used.
+
+    :param A: Nutrients per 100g of food, shape (foods x nutrients)
+    :param targets: Target amount per nutrient. Nutrients with a target <= 0 are ignored
+    :param group_indices: Per group, the indices of its foods. Foods in none of the groups are not used.
+                          The groups must not overlap
+    :param group_limits: Per group, the maximum number of grams
+    :param excess_weight: Weight of the relative excess of a nutrient compared to its shortfall
+    :param max_iterations: Maximum number of simplex iterations
+    :return: Grams per food
+    :raises RuntimeError: If the optimum has not been found within max_iterations
+    """
+
+    A = np.asarray(A, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    used = targets > 0
+    num_nutrients = int(used.sum())
+    num_groups = len(group_indices)
+    foods = np.concatenate([np.asarray(indices, dtype=np.intp) for indices in group_indices] or [np.zeros(0, dtype=np.intp)])
+    num_foods = len(foods)
+
+    # Columns of the constraints: grams per food | shortfall per nutrient | excess per nutrient | slack per group
+    shortfall, excess, slack = num_foods, num_foods + num_nutrients, num_foods + 2 * num_nutrients
+    constraints = np.zeros((num_nutrients + num_groups, slack + num_groups))
+    constraints[:num_nutrients, :num_foods] = (A[foods][:, used] / 100 / targets[used]).T
+    constraints[:num_nutrients, shortfall:excess] = np.eye(num_nutrients)
+    constraints[:num_nutrients, excess:slack] = -np.eye(num_nutrients)
+    start = 0
+    for group, indices in enumerate(group_indices):
+        constraints[num_nutrients + group, start:start + len(indices)] = 1
+        start += len(indices)
+    constraints[num_nutrients:, slack:] = np.eye(num_groups)
+    rhs = np.concatenate([np.ones(num_nutrients), np.asarray(group_limits, dtype=float)])
+    costs = np.concatenate([np.zeros(num_foods), np.ones(num_nutrients), np.full(num_nutrients, excess_weight), np.zeros(num_groups)])
+
+    # All shortfalls at 100% and all group slacks at their limit (no food at all) is a feasible starting basis
+    basis = np.concatenate([np.arange(shortfall, excess), np.arange(slack, slack + num_groups)])
+    solution = _simplex(costs, constraints, rhs, basis, max_iterations)
+
+    grams = np.zeros(A.shape[0])
+    grams[foods] = solution[:num_foods]
+    return grams
+
+
+def solve_diets(A: np.ndarray, targets: np.ndarray, group_indices: list[np.ndarray], group_limits: np.ndarray,
+                excess_weight: float = 0.1, processes: int = None) -> np.ndarray:
+    """
+    Solve the diet for many target vectors at once, e.g. the per capita needs of every country and year
+
+    The nutrient matrix and the food groups are shared by all targets. With multiple processes, they are sent
+    to every worker process once, after which the workers only receive the target vectors.
+
+    :param A: Nutrients per 100g of food, shape (foods x nutrients)
+    :param targets: Target amounts, shape (targets x nutrients)
+    :param group_indices: Per group, the indices of its foods, see solve_diet
+    :param group_limits: Per group, the maximum number of grams
+    :param excess_weight: Weight of the relative excess of a nutrient compared to its shortfall
+    :param processes: Number of worker processes. If 1, all targets are solved in the current process.
+                      If None, the number of CPUs is used
+    :return: Grams per food for every target, shape (targets x foods)
+    """
+
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    problem = (np.asarray(A, dtype=float), group_indices, np.asarray(group_limits, dtype=float), excess_weight)
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(targets) <= 1:
+        grams = [solve_diet(problem[0], target, *problem[1:]) for target in targets]
+        return np.array(grams).reshape(len(targets), problem[0].shape[0])
+
+    # Send the targets in chunks, so every worker gets a few chunks to balance the load
+    chunksize = max(1, len(targets) // (4 * processes))
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=problem) as executor:
+        return np.array(list(executor.map(_solve_worker_target, targets, chunksize=chunksize)))
+
+
+def _init_worker(A, group_indices, group_limits, excess_weight):
+    global _worker_problem
+    _worker_problem = (A, group_indices, group_limits, excess_weight)
+
+
+def _solve_worker_target(target: np.ndarray) -> np.ndarray:
+    A, group_indices, group_limits, excess_weight = _worker_problem
+    return solve_diet(A, target, group_indices, group_limits, excess_weight)
+
+
+def _simplex(costs: np.ndarray, constraints: np.ndarray, rhs: np.ndarray, basis: np.ndarray,
+             max_iterations: int, tolerance: float = 1e-9) -> np.ndarray:
+    """
+    Revised simplex method for: minimize costs @ x subject to constraints @ x == rhs, x >= 0
+
+    :param basis: Indices of the columns of a feasible starting basis
+    :return: Optimal x
+    :raises RuntimeError: If no optimal basis has been found within max_iterations
+    """
+
+    num_constraints, num_variables = constraints.shape
+    basis = basis.copy()
+    degenerate_steps = 0
+    for _ in range(max_iterations):
+        basis_matrix = constraints[:, basis]
+        basic_values = np.linalg.solve(basis_matrix, rhs)
+        duals = np.linalg.solve(basis_matrix.T, costs[basis])
+        reduced_costs = costs - constraints.T @ duals
+        reduced_costs[basis] = 0
+
+        # Dantzig's rule, falling back to Bland's rule to avoid cycling when stalling: the first improving column
+        # enters, and of the rows with the smallest ratio, the one of the basic variable with the smallest index leaves
+        bland = degenerate_steps > num_constraints
+        if bland:
+            candidates = np.flatnonzero(reduced_costs < -tolerance)
+            entering = candidates[0] if len(candidates) else None
+        else:
+            entering = int(np.argmin(reduced_costs))
+            entering = entering if reduced_costs[entering] < -tolerance else None
+        if entering is None:
+            break
+
+        direction = np.linalg.solve(basis_matrix, constraints[:, entering])
+        positive = direction > tolerance
+        if not np.any(positive):
+            raise ValueError('The linear program is unbounded')
+        ratios = np.full(num_constraints, np.inf)
+        ratios[positive] = np.maximum(basic_values[positive], 0) / direction[positive]
+        leaving = int(np.argmin(ratios))
+        if bland:
+            ties = np.flatnonzero(ratios <= ratios[leaving] + tolerance)
+            leaving = int(ties[np.argmin(basis[ties])])
+        degenerate_steps = degenerate_steps + 1 if ratios[leaving] <= tolerance else 0
+        basis[leaving] = entering
+    else:
+        raise RuntimeError(f'The simplex method did not find an optimal solution within {max_iterations:,} iterations')
+
+    solution = np.zeros(num_variables)
+    solution[basis] = np.maximum(np.linalg.solve(constraints[:, basis], rhs), 0)
+    return solution
+
+
+if __name__ == '__main__':
+    # Real food example: nutrients in 100g of food. The three columns represent vitamin A, vitamin C, and energy in kCal
+    A = np.array([
+        [53.2, 0.9, 49],  # Orange
+        [0, 31, 165],  # Chicken Breast
+        [89.2, 2.8, 34],  # Broccoli
+        [0, 21, 579],  # Almonds
+        [0, 20, 208],  # Salmon
+        [0, 2.7, 130],  # Rice
+        [28.1, 2.9, 23],  # Spinach
+        [0, 0, 387],  # Sugar
+    ])
+    optimal_nutrients = np.array([80, 80, 2000])  # Vitamin A in mg, Vitamin C in mg, Calories in kcal
+    groups = [np.array([0]), np.array([1, 4]), np.array([2, 6]), np.array([3]), np.array([5]), np.array([7])]
+    limits = np.array([200, 150, 400, 50, 300, 50])  # Fruits, Meat and fish, Vegetables, Nuts, Grains, Sugar
+
+    grams = solve_diet(A, optimal_nutrients, groups, limits)
+    print(f'Optimal grams: {grams.astype(int)}')
+    print(f'Obtained nutrients: {(grams @ A / 100).astype(int)}')
+    print(f'Optimal nutrients: {optimal_nutrients}')
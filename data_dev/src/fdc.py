@@ -1,15 +1,25 @@
 import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 
-import base64
 import csv
 import hashlib
 import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 from functools import cached_property
-from typing import Generator, Literal, TypedDict
+from requests.adapters import HTTPAdapter
+from typing import Generator, Iterable, Literal, Mapping, TypedDict
 
-from common import DATA_DIR, JSON, get_secret
+from common import DATA_DIR, JSON, file_fingerprint, get_secret
+from fdc_cache import FDC_CACHE_DIR, CachedApi, FileCache, ResponseCache
+from fdc_index import FoodIndex, LazyCsvRows, build_food_index, load_food_index, save_food_index
+from fdc_sparse import SparseFoodNutrients, build_sparse_food_nutrients, load_sparse_food_nutrients, \
+    save_sparse_food_nutrients
 
 FdcDataType = Literal['Branded', 'Foundation', 'Survey (FNDDS)', 'SR Legacy']
 
@@ -70,6 +80,59 @@ class FoodDict(TypedDict):
     foodNutrients: list[FoodNutrientDict]
 
 
+class FdcApi(CachedApi):
+    """
+    The parts of calling the FDC API that FoodDataCentral and fdc_async.AsyncFoodDataCentral share,
+    besides the URLs and the cache: the API key, and the parameters and cached responses of the calls
+    """
+
+    @cached_property
+    def api_key(self) -> str:
+        """
+        Get the API key from the secrets file, or return a demo key if no proper API key has been defined
+        """
+
+        try:
+            return get_secret('FOOD_DATA_CENTRAL_API_KEY')
+        except (KeyError, FileNotFoundError, json.JSONDecodeError):
+            return 'DEMO_KEY'
+
+    @staticmethod
+    def food_list_params(data_types: list[FdcDataType] = None) -> dict:
+        """
+        Parameters of a call to list the food items of the given data types, Foundation and SR Legacy by default
+        """
+
+        if not data_types:
+            data_types = ['Foundation', 'SR Legacy']
+        return {'dataType': ','.join(data_types)}
+
+    def get_foods_from_cache(self, fdc_ids: list[int], nutrients: list[str] = None) -> tuple[dict, dict, list[int]]:
+        """
+        Look up food items in the cache, with the same URLs as get_food
+
+        :return: The URL per FDC ID, the cached food item (or None) per FDC ID, and the FDC IDs that are not cached
+        """
+
+        nutrients = ','.join(nutrients) if nutrients else None
+        urls = {fdc_id: self.build_url(f'v1/food/{fdc_id}', {'nutrients': nutrients}) for fdc_id in fdc_ids}
+        cached = self.get_responses_from_cache(urls.values())
+        foods = {fdc_id: cached.get(url) for fdc_id, url in urls.items()}
+        missing_fdc_ids = [fdc_id for fdc_id, food in foods.items() if food is None]
+        return urls, foods, missing_fdc_ids
+
+    @staticmethod
+    def get_foods_body(fdc_ids: list[int], nutrients: list[str] = None) -> dict:
+        """
+        Request body of a call to get multiple food items
+        """
+
+        body = {'fdcIds': fdc_ids, 'format': 'full'}
+        if nutrients:
+            body['nutrients'] = [int(nutrient) for nutrient in nutrients]
+        return body
+
+
 class FoodDataCentral:
     """
     Class to interact with the USDA Food Data Central API
@@ -95,23 +158,59 @@ class FoodDataCentral:
     Cache
 
     The API responses are cached in the `data/fdc_cache` directory. This is to avoid making the same request
-    multiple times. The cache is stored as JSON files with the URL as the filename. The URL is hashed using
-    SHA-256 and then encoded using base64. The cache is only used for GET requests. If you want to force a
-    request to the API, you can delete the corresponding cache file.
+    multiple times. The cache is keyed by the URL, hashed using SHA-256 and then encoded using base64.
+    The cache is only used for GET requests. By default, every response is stored as a JSON file with the
+    hashed URL as the filename. For many cached responses, pass a `fdc_cache.SqliteCache` instead, which stores
+    all responses compressed in a single file and reads them in batches. Existing JSON files can be moved into it
+    by running `fdc_cache.py`. Both caches take a `max_size` in bytes, beyond which the least recently used
+    responses are evicted. In front of that cache, the last `memory_cache_size` responses that were used are kept
+    in memory, so repeated lookups within the same process do not read from disk. Its `hits` and `misses` are
+    counted on `self.cache`. The pages of paginated calls bypass this memory cache, so iterating over large
+    data types like Branded does not keep their pages in memory.
+
+    By default, cached responses never expire. With `cache_ttls`, the responses of an endpoint expire after the
+    given number of seconds, e.g. {'v1/foods/list': 7 * 24 * 3600, 'v1/food/': 30 * 24 * 3600}.
+    An expired response is revalidated with a conditional GET if the API sent an ETag or Last-Modified header
+    for it, so it is only downloaded again if it has changed. Otherwise it is downloaded again.
+
+    Concurrency
+
+    All requests go through one pooled HTTP session. With `max_workers` > 1, the pages of paginated calls are
+    fetched concurrently by a pool of threads, while still being yielded in page order. The number of pages in
+    flight is limited by the X-Ratelimit-Remaining header of the latest response, and no new pages are requested
+    once an empty page has been seen. This can request up to `max_workers` - 1 pages past the last page.
     """
 
     BASE_URL = 'https://api.nal.usda.gov/fdc'
+    MAX_FOODS_PER_CALL = 20
+    CACHE_DIR = FDC_CACHE_DIR
 
-    @cached_property
-    def api_key(self) -> str:
+    def __init__(self, max_workers: int = 1, base_url: str = None, cache: ResponseCache = None,
+                 cache_ttls: dict[str, float] = None, memory_cache_size: int = 64):
         """
-        Get the API key from the secrets file, or return a demo key if no proper API key has been defined
+        :param max_workers: Number of pages of a paginated call that are fetched concurrently
+        :param base_url: Base URL of the API, e.g. to use a local stub server instead of the real API
+        :param cache: Store of the cached responses. If None, one JSON file per response in CACHE_DIR is used
+        :param cache_ttls: Seconds after which cached responses expire, per endpoint, given as the start of the URL
+                           after the base URL. The longest matching endpoint is used.
+                           Responses of endpoints that are not listed never expire
+        :param memory_cache_size: Number of responses to keep in memory in front of the cache. If 0, none are kept.
+                                  Pages of paginated calls are never kept in memory
         """
 
-        try:
-            return get_secret('FOOD_DATA_CENTRAL_API_KEY')
-        except (KeyError, FileNotFoundError, json.JSONDecodeError):
-            return 'DEMO_KEY'
+        self.max_workers = max_workers
+        self.api = FdcApi(base_url or self.BASE_URL, cache or FileCache(self.CACHE_DIR), cache_ttls=cache_ttls,
+                          memory_cache_size=memory_cache_size)
+
+        # HTTP session with a connection pool that is large enough for all workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_workers, 10))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def cache(self) -> ResponseCache:
+        return self.api.cache
 
     def food_list(self, data_types: list[FdcDataType] = None) -> Generator[FoodDict, None, None]:
         """
@@ -122,14 +221,7 @@ class FoodDataCentral:
         :return: Generator over all food items with their nutrients in the FDC database
         """
 
-        if not data_types:
-            data_types = ['Foundation', 'SR Legacy']
-
-        url = 'v1/foods/list'
-        params = {
-            'dataType': ','.join(data_types),
-        }
-        yield from self._make_paginated_get_call(url, params)
+        yield from self._make_paginated_get_call('v1/foods/list', self.api.food_list_params(data_types))
 
     def get_food(self, fdc_id: int, nutrients: list[str] = None) -> FoodDict:
         """
@@ -144,6 +236,27 @@ class FoodDataCentral:
         nutrients = ','.join(nutrients) if nutrients else None
         return self._make_get_call(url, params={'nutrients': nutrients})  # noqa
 
+    def get_foods(self, fdc_ids: list[int], nutrients: list[str] = None) -> list[FoodDict]:
+        """
+        Get multiple food items by their FDC IDs, with one API call per 20 food items that are not cached yet
+
+        Every food item is cached separately, under the same URL as get_food would use,
+        so later lookups of single food items hit the cache.
+
+        :param fdc_ids: FDC identifiers of the food items
+        :param nutrients: Nutrients you are interested in. If None, all nutrients are returned
+        :return: Food items with their nutrients, in the order of the given FDC IDs. Unknown FDC IDs are left out
+        """
+
+        urls, foods, missing_fdc_ids = self.api.get_foods_from_cache(fdc_ids, nutrients)
+        for start in range(0, len(missing_fdc_ids), self.MAX_FOODS_PER_CALL):
+            batch = missing_fdc_ids[start:start + self.MAX_FOODS_PER_CALL]
+            new_foods = self._make_post_call('v1/foods', self.api.get_foods_body(batch, nutrients))
+            for food in new_foods:
+                foods[food['fdcId']] = food
+            self.api.add_responses_to_cache({urls[food['fdcId']]: food for food in new_foods})
+        return [foods[fdc_id] for fdc_id in fdc_ids if foods.get(fdc_id) is not None]
+
     def _make_paginated_get_call(self, url: str, params: dict = None) -> Generator[JSON, None, None]:
         """
         Make a paginated GET call to the API
@@ -157,10 +270,14 @@ class FoodDataCentral:
         params = params or {}
         if 'pageSize' not in params:
             params['pageSize'] = 50
+        if self.max_workers > 1:
+            yield from self._make_concurrent_paginated_get_call(url, params)
+            return
+
         page = 1
         while True:
             params['pageNumber'] = page
-            data = self._make_get_call(url, params)
+            data = self._make_get_call(url, params, use_memory_cache=False)
             if not data:
                 break
             # Verify that the returned data is indeed a list to yield from
@@ -169,90 +286,139 @@ class FoodDataCentral:
             yield from data
             page += 1
 
-    def _make_get_call(self, url: str, params: dict = None) -> JSON:
+    def _make_concurrent_paginated_get_call(self, url: str, params: dict) -> Generator[JSON, None, None]:
         """
-        Make a GET call to the API
+        Make a paginated GET call to the API, fetching multiple pages concurrently
 
         :param url: URL to make the GET call to
-        :param params: Parameters to pass in the GET call
+        :param params: Parameters to pass in the GET call, including the `pageSize`
+        :return: Generator over all items in the paginated response, in page order
         """
 
-        # We build the URL with the parameters instead of using params in requests.get(),
-        # in order to have a consistent URL for the cache
-        url = f'{self.BASE_URL}/{url}'
-        params = params or {}
-        url_params = '&'.join([f'{key}={value}' for key, value in params.items()])
-        if url_params:
-            url = f'{url}?{url_params}'
-
-        # Check if the response is already in the cache
-        data = self._get_response_from_cache(url)
-
-        # If the response is not in the cache yet, get the response from the API and add it to the cache
-        if data is None:
-            response = requests.get(url, params={'api_key': self.api_key})
-            response.raise_for_status()
-            data = response.json()
-            self._add_response_to_cache(url, data)
+        pending = deque()  # (page number, future) of the requested pages, in page order
+        next_page = 1
+        end_seen = False
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                # Request new pages while the end has not been seen, within the worker and rate limits
+                while not end_seen and len(pending) < self.api.max_calls_in_flight(self.max_workers):
+                    future = executor.submit(self._make_get_call, url, {**params, 'pageNumber': next_page}, False)
+                    pending.append((next_page, future))
+                    next_page += 1
+                if not pending:
+                    break
 
-            ratelimit_remaining = response.headers.get('X-Ratelimit-Remaining')
-            ratelimit_limit = response.headers.get('X-Ratelimit-Limit')
-            print(f'Added response from {url} to cache. Remaining calls: {ratelimit_remaining}/{ratelimit_limit}')
+                _, future = pending.popleft()
+                data = future.result()
+                if not data:
+                    break
+                # Verify that the returned data is indeed a list to yield from
+                if not isinstance(data, list):
+                    raise ValueError(f'Expected a list, but got {type(data)}')
+                end_seen = end_seen or any(
+                    future.done() and not future.exception() and not future.result() for _, future in pending
+                )
+                yield from data
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _make_get_call(self, url: str, params: dict = None, use_memory_cache: bool = True) -> JSON:
+        """
+        Make a GET call to the API
 
+        :param url: URL to make the GET call to
+        :param params: Parameters to pass in the GET call
+        :param use_memory_cache: Whether the cached response may be kept in memory, see CachedApi.get_cache_entry
+        """
+
+        url = self.api.build_url(url, params)
+
+        # Check if the response is already in the cache and has not expired yet
+        entry = self.api.get_cache_entry(url, use_memory_cache)
+        if entry is not None and self.api.is_fresh(url, entry):
+            return entry['data']
+
+        # If not, get the response from the API and add it to the cache.
+        # An expired response is revalidated, so it is not downloaded again if it has not changed
+        response = self.session.get(url, params={'api_key': self.api.api_key},
+                                    headers=self.api.revalidation_headers(entry))
+        ratelimit = self.api.update_ratelimit(response.headers)
+        if response.status_code == 304:
+            self.api.touch(url)
+            print(f'Revalidated cached response from {url}. Remaining calls: {ratelimit}')
+            return entry['data']
+
+        response.raise_for_status()
+        data = response.json()
+        self.api.add_response_to_cache(url, data, response.headers)
+        print(f'Added response from {url} to cache. Remaining calls: {ratelimit}')
         return data
 
-    @staticmethod
-    def _hash_url_to_alphanumeric(url: str) -> str:
+    def _make_post_call(self, url: str, body: dict) -> JSON:
         """
-        Hash a URL to an alphanumeric string
+        Make a POST call to the API. POST calls are not cached
 
-        >>> FoodDataCentral._hash_url_to_alphanumeric('https://example.com')
-        'EAaArVRs5qV39C9S3zO0z9ynVoWeZkuNfeMpsVDQnOk'
+        :param url: URL to make the POST call to
+        :param body: JSON body of the POST call
         """
 
-        # Step 1: Hash the URL using SHA-256
-        url_hash = hashlib.sha256(url.encode('utf-8')).digest()
-
-        # Step 2: Encode the hash using base64
-        base64_encoded = base64.urlsafe_b64encode(url_hash).decode('utf-8')
+        url = self.api.build_url(url)
+        response = self.session.post(url, params={'api_key': self.api.api_key}, json=body)
+        response.raise_for_status()
 
-        # Step 3: Remove any '=' characters used as padding in base64 encoding
-        alphanumeric_hash = base64_encoded.rstrip('=')
-
-        return alphanumeric_hash
-
-    def _get_response_from_cache(self, url: str) -> JSON:
-        """
-        Get the cached response for a given URL
-        """
-
-        url_hash = self._hash_url_to_alphanumeric(url)
-        cache_file = os.path.join(DATA_DIR, 'fdc_cache', f'{url_hash}.json')
-        if os.path.exists(cache_file):
-            with open(cache_file) as f:
-                return json.load(f)
-        return None
-
-    def _add_response_to_cache(self, url: str, data: JSON):
-        """
-        Add a response to the cache
-        """
-
-        url_hash = self._hash_url_to_alphanumeric(url)
-        cache_file = os.path.join(DATA_DIR, 'fdc_cache', f'{url_hash}.json')
-        with open(cache_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        ratelimit = self.api.update_ratelimit(response.headers)
+        print(f'Made POST call to {url}. Remaining calls: {ratelimit}')
+        return response.json()
 
 
 class CsvGenerator:
     """
     Class to convert FDC API data into CSV format
+
+    By default, all food items are fetched into memory once and the CSV files are sorted by fdcId.
+    In streaming mode, the food items are iterated from the (cached) API pages every time they are needed,
+    and the CSV rows are written while iterating, in the order of the API. The peak memory usage then does
+    not depend on the number of food items, which is needed for large data types like Branded.
+
+    In incremental mode, food_nutrients.csv is updated instead of rewritten. A manifest keeps the publicationDate
+    and a hash of the API data of every food item. Only food items that are new or changed since the previous run
+    are flattened again and merged into the (sorted) CSV file, while the rows of unchanged food items are copied
+    as they are, and rows of food items that no longer exist are left out. The CSV file is written from scratch
+    if there is no manifest yet or if the nutrient columns have changed. The Parquet file and the CSR matrix
+    are regenerated along with it, if they exist, so they do not keep the previous food nutrients. Cached list
+    pages expire after INCREMENTAL_CACHE_TTLS, so a new run revalidates them and sees the changes of the API.
+    Incremental mode cannot be combined with streaming mode, since writing the CSV file from scratch sorts
+    all food items.
     """
 
     FDC_DATA_DIR = os.path.join(DATA_DIR, 'fdc_data')
-
-    def __init__(self):
-        self.fdc = FoodDataCentral()
+    NUTRIENT_DEFINITIONS_CSV = os.path.join(FDC_DATA_DIR, 'nutrient_definitions.csv')
+    FOOD_NUTRIENTS_PARQUET = os.path.join(FDC_DATA_DIR, 'food_nutrients.parquet')
+    FOOD_NUTRIENTS_CSR_DIR = os.path.join(FDC_DATA_DIR, 'food_nutrients_csr')
+    FOOD_NUTRIENTS_MANIFEST = os.path.join(FDC_DATA_DIR, 'food_nutrients_manifest.json')
+    FOOD_FIELD_NAMES = ['fdcId', 'description', 'dataType', 'publicationDate', 'ndbNumber']
+    PARQUET_ROW_GROUP_SIZE = 10_000
+    INCREMENTAL_CACHE_TTLS = {'v1/foods/list': 12 * 3600}
+
+    def __init__(self, data_types: list[FdcDataType] = None, streaming: bool = False, incremental: bool = False,
+                 fdc: FoodDataCentral = None):
+        """
+        :param data_types: Data types of the food items. If None, Foundation and SR Legacy are used
+        :param streaming: Iterate the food items from the API pages every time, see above
+        :param incremental: Update food_nutrients.csv instead of rewriting it, see above
+        :param fdc: Client of the FDC API. If None, one with the default cache is used,
+                    with INCREMENTAL_CACHE_TTLS in incremental mode
+        """
+
+        if streaming and incremental:
+            raise ValueError('Incremental mode cannot be combined with streaming mode')
+        self.fdc = fdc or FoodDataCentral(cache_ttls=self.INCREMENTAL_CACHE_TTLS if incremental else None)
+        self.data_types = data_types
+        self.streaming = streaming
+        self.incremental = incremental
 
     @cached_property
     def food_list(self) -> list[FoodDict]:
@@ -261,7 +427,16 @@ class CsvGenerator:
         Cache the result in the class, so we don't need to fetch the data multiple times
         """
 
-        return list(self.fdc.food_list())
+        return list(self.fdc.food_list(self.data_types))
+
+    def foods(self) -> Iterable[FoodDict]:
+        """
+        Get all food items: a new pass over the API pages in streaming mode, else the list in memory
+        """
+
+        if self.streaming:
+            return self.fdc.food_list(self.data_types)
+        return self.food_list
 
     def generate_nutrient_definitions_csv(self) -> str:
         """
@@ -284,12 +459,12 @@ class CsvGenerator:
                 'derivationCode': nutrient.get('derivationCode'),
                 'derivationDescription': nutrient.get('derivationDescription'),
             }
-            for food in self.food_list
+            for food in self.foods()
             for nutrient in food['foodNutrients']
         }
         nutrients = sorted(result.values(), key=itemgetter('number'))
 
-        nutrients_csv = os.path.join(self.FDC_DATA_DIR, 'nutrient_definitions.csv')
+        nutrients_csv = self.NUTRIENT_DEFINITIONS_CSV
         with open(nutrients_csv, 'w') as f:
             writer = csv.DictWriter(f, fieldnames=nutrients[0].keys(), delimiter=';')
             writer.writeheader()
@@ -298,10 +473,13 @@ class CsvGenerator:
         print(f'Successfully written {len(nutrients)} nutrient definitions to {nutrients_csv}')
         return nutrients_csv
 
-    def generate_food_nutrients_csv(self) -> str:
+    def generate_food_nutrients_csv(self, use_nutrient_definitions: bool = False) -> str:
         """
         Generate a CSV file with all food nutrients
 
+        :param use_nutrient_definitions: Take the nutrient columns from nutrient_definitions.csv, instead of
+                                         collecting them from all food items. Nutrients that are not in that file
+                                         are left out. In streaming mode, this saves a pass over all food items
         :return: Path to the generated CSV file
 
         Snippet from file:
@@ -312,46 +490,235 @@ class CsvGenerator:
         167515;George Weston Bakeries, Thomas English Muffins;SR Legacy;2019-04-01;18639;;;8.0;1.8;46.0
         """
 
-        # Flatten the food nutrients into a list of dictionaries
-        food_nutrients = [
-            {
-                'fdcId': food['fdcId'],
-                'description': food['description'],
-                'dataType': food['dataType'],
-                'publicationDate': food['publicationDate'],
-                'ndbNumber': food['ndbNumber'],
-                **{nutrient['number']: nutrient.get('amount', 0) for nutrient in food['foodNutrients']}
-            }
-            for food in self.food_list
-        ]
-        food_nutrients.sort(key=itemgetter('fdcId'))
-
-        # Write the food nutrients to a CSV file
+        field_names = self.FOOD_FIELD_NAMES + self._nutrient_numbers(use_nutrient_definitions)
         food_nutrients_csv = os.path.join(self.FDC_DATA_DIR, 'food_nutrients.csv')
-
-        # Concatenate all keys from all dictionaries into a set
-        all_field_names = {key for food in food_nutrients for key in food.keys()}
-        food_field_names = ['fdcId', 'description', 'dataType', 'publicationDate', 'ndbNumber']
-        nutrient_field_names = sorted(all_field_names - set(food_field_names))
-        field_names = food_field_names + nutrient_field_names
+        if self.incremental and self._update_food_nutrients_csv(food_nutrients_csv, field_names):
+            self._regenerate_derived_files(use_nutrient_definitions)
+            return food_nutrients_csv
 
         # Write the CSV file
+        food_nutrients = self._food_nutrients()
+        nr_food_nutrients = 0
         with open(food_nutrients_csv, 'w') as f:
-            writer = csv.DictWriter(f, fieldnames=field_names, delimiter=';')
+            writer = csv.DictWriter(f, fieldnames=field_names, delimiter=';', extrasaction='ignore')
             writer.writeheader()
-            writer.writerows(food_nutrients)
-
-        print(f'Successfully written {len(food_nutrients)} food nutrients to {food_nutrients_csv}')
+            for food in food_nutrients:
+                writer.writerow(food)
+                nr_food_nutrients += 1
+        if self.incremental:
+            self._write_manifest(field_names, {str(food['fdcId']): self._manifest_entry(food) for food in self.foods()})
+            self._regenerate_derived_files(use_nutrient_definitions)
+
+        print(f'Successfully written {nr_food_nutrients} food nutrients to {food_nutrients_csv}')
         return food_nutrients_csv
 
+    def generate_food_nutrients_parquet(self, use_nutrient_definitions: bool = False) -> str:
+        """
+        Generate a Parquet file with the same food nutrients as generate_food_nutrients_csv, indexed by fdcId.
+        Every nutrient number is a float32 column, with nulls for nutrients that a food item does not have.
+        Rows are written in row groups of PARQUET_ROW_GROUP_SIZE food items, so streaming mode still applies
+
+        :param use_nutrient_definitions: Take the nutrient columns from nutrient_definitions.csv,
+                                         see generate_food_nutrients_csv
+        :return: Path to the generated Parquet file
+        """
+
+        nutrient_numbers = self._nutrient_numbers(use_nutrient_definitions)
+        field_names = self.FOOD_FIELD_NAMES + nutrient_numbers
+        schema = pa.schema(
+            [('fdcId', pa.int64())]
+            + [(field_name, pa.string()) for field_name in self.FOOD_FIELD_NAMES[1:]]
+            + [(nutrient_number, pa.float32()) for nutrient_number in nutrient_numbers]
+        )
+        # Add the pandas metadata to the schema, so the file is read back with fdcId as index
+        schema = self._food_nutrients_table([], field_names, schema).schema
+
+        food_nutrients_parquet = self.FOOD_NUTRIENTS_PARQUET
+        nr_food_nutrients = 0
+        with pq.ParquetWriter(food_nutrients_parquet, schema) as writer:
+            rows = []
+            for food in self._food_nutrients():
+                rows.append(food)
+                if len(rows) == self.PARQUET_ROW_GROUP_SIZE:
+                    writer.write_table(self._food_nutrients_table(rows, field_names, schema))
+                    nr_food_nutrients += len(rows)
+                    rows = []
+            if rows or not nr_food_nutrients:
+                writer.write_table(self._food_nutrients_table(rows, field_names, schema))
+                nr_food_nutrients += len(rows)
+
+        print(f'Successfully written {nr_food_nutrients} food nutrients to {food_nutrients_parquet}')
+        return food_nutrients_parquet
+
+    def generate_food_nutrients_csr(self) -> str:
+        """
+        Generate a sparse CSR matrix of the food nutrients, with only the nutrients that every food item reports.
+        Its nutrient columns are collected in the same pass over the food items, see fdc_sparse
+
+        :return: Path to the generated directory with the arrays of the matrix
+        """
+
+        foods = self.foods()
+        if not self.streaming:
+            foods = sorted(foods, key=itemgetter('fdcId'))
+        sparse = build_sparse_food_nutrients(foods)
+        food_nutrients_csr_dir = save_sparse_food_nutrients(sparse, self.FOOD_NUTRIENTS_CSR_DIR)
+
+        print(f'Successfully written {sparse.shape[0]} food nutrients with {len(sparse.data)} amounts '
+              f'to {food_nutrients_csr_dir}')
+        return food_nutrients_csr_dir
+
+    def _update_food_nutrients_csv(self, food_nutrients_csv: str, field_names: list[str]) -> bool:
+        """
+        Merge the food items that are new or changed according to the manifest into the existing CSV file
+
+        :return: Whether the CSV file has been updated. If False, it has to be written from scratch
+        """
+
+        if not os.path.exists(self.FOOD_NUTRIENTS_MANIFEST) or not os.path.exists(food_nutrients_csv):
+            return False
+        with open(self.FOOD_NUTRIENTS_MANIFEST) as f:
+            manifest = json.load(f)
+        if manifest['field_names'] != field_names:
+            return False
+
+        # Flatten only the food items that are new or changed
+        previous_foods = manifest['foods']
+        foods = {}
+        changed_food_nutrients = []
+        for food in self.foods():
+            fdc_id = str(food['fdcId'])
+            foods[fdc_id] = self._manifest_entry(food)
+            if previous_foods.get(fdc_id) != foods[fdc_id]:
+                changed_food_nutrients.append(self._flatten_food(food))
+        changed_food_nutrients.sort(key=itemgetter('fdcId'))
+        changed_fdc_ids = {str(food['fdcId']) for food in changed_food_nutrients}
+
+        # Merge them by fdcId with the rows of the unchanged food items, which are copied without parsing them
+        changed = iter(changed_food_nutrients)
+        next_changed = next(changed, None)
+        with open(food_nutrients_csv, 'rb') as old_file, open(f'{food_nutrients_csv}.tmp', 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=field_names, delimiter=';', extrasaction='ignore')
+            writer.writeheader()
+            LazyCsvRows.read_record(old_file)  # Header
+            while record := LazyCsvRows.read_record(old_file):
+                fdc_id = record.split(b';', 1)[0].decode('utf-8')
+                if fdc_id not in foods or fdc_id in changed_fdc_ids:
+                    continue
+                while next_changed is not None and next_changed['fdcId'] < int(fdc_id):
+                    writer.writerow(next_changed)
+                    next_changed = next(changed, None)
+                f.write(record.decode('utf-8'))
+            while next_changed is not None:
+                writer.writerow(next_changed)
+                next_changed = next(changed, None)
+        os.replace(f'{food_nutrients_csv}.tmp', food_nutrients_csv)
+        self._write_manifest(field_names, foods)
+
+        nr_removed = len(set(previous_foods) - set(foods))
+        print(f'Successfully updated {len(foods)} food nutrients in {food_nutrients_csv}: '
+              f'{len(changed_fdc_ids)} new or changed, {nr_removed} removed')
+        return True
+
+    def _regenerate_derived_files(self, use_nutrient_definitions: bool = False):
+        """
+        Regenerate the Parquet file and the CSR matrix, if they exist, after food_nutrients.csv has been updated,
+        so Explorer does not read stale food nutrients from them. The lookup indexes of Explorer are rebuilt on
+        their next use, since the fingerprint of their source file changes
+        """
+
+        if os.path.exists(self.FOOD_NUTRIENTS_PARQUET):
+            self.generate_food_nutrients_parquet(use_nutrient_definitions)
+        if os.path.exists(self.FOOD_NUTRIENTS_CSR_DIR):
+            self.generate_food_nutrients_csr()
+
+    @staticmethod
+    def _manifest_entry(food: FoodDict) -> list[str]:
+        """
+        The publicationDate and the SHA-256 hash of the API data of a food item, to detect changes
+        """
+
+        food_hash = hashlib.sha256(json.dumps(food, sort_keys=True).encode('utf-8')).hexdigest()
+        return [food.get('publicationDate', ''), food_hash]
+
+    def _write_manifest(self, field_names: list[str], foods: dict[str, list[str]]):
+        with open(self.FOOD_NUTRIENTS_MANIFEST, 'w') as f:
+            json.dump({'field_names': field_names, 'foods': foods}, f)
+
+    def _nutrient_numbers(self, use_nutrient_definitions: bool = False) -> list[str]:
+        """
+        Sorted nutrient numbers of the food nutrients files, see generate_food_nutrients_csv
+        """
+
+        if use_nutrient_definitions:
+            with open(self.NUTRIENT_DEFINITIONS_CSV) as f:
+                nutrient_numbers = {row['number'] for row in csv.DictReader(f, delimiter=';')}
+        else:
+            # Concatenate all nutrient numbers from all food items into a set
+            nutrient_numbers = {nutrient['number'] for food in self.foods() for nutrient in food['foodNutrients']}
+        return sorted(nutrient_numbers)
+
+    def _food_nutrients(self) -> Iterable[dict]:
+        """
+        Flatten the food nutrients into dictionaries, either all at once sorted by fdcId, or one by one
+        in streaming mode
+        """
+
+        food_nutrients = map(self._flatten_food, self.foods())
+        if not self.streaming:
+            food_nutrients = sorted(food_nutrients, key=itemgetter('fdcId'))
+        return food_nutrients
+
+    @staticmethod
+    def _food_nutrients_table(food_nutrients: list[dict], field_names: list[str], schema: pa.Schema) -> pa.Table:
+        """
+        Convert flattened food nutrients to an Arrow table indexed by fdcId, with string food fields
+        (e.g. the API returns ndbNumber as an int) and float32 nutrient columns
+        """
+
+        df = pd.DataFrame.from_records(food_nutrients, columns=field_names)
+        df['fdcId'] = df['fdcId'].astype('int64')
+        # Convert the values themselves, since pandas turns a column of ints with missing values into floats
+        for field_name in CsvGenerator.FOOD_FIELD_NAMES[1:]:
+            values = [food.get(field_name) for food in food_nutrients]
+            df[field_name] = pd.array([None if value is None else str(value) for value in values], dtype='string')
+        nutrient_columns = field_names[len(CsvGenerator.FOOD_FIELD_NAMES):]
+        df[nutrient_columns] = df[nutrient_columns].astype('float32')
+        return pa.Table.from_pandas(df.set_index('fdcId'), schema=schema, preserve_index=True)
+
+    @staticmethod
+    def _flatten_food(food: FoodDict) -> dict:
+        """
+        Flatten a food item into a dictionary with the food fields and the amount per nutrient number.
+        Food fields other than fdcId are optional, e.g. Branded food items have no ndbNumber, and are empty if missing
+        """
+
+        return {
+            'fdcId': food['fdcId'],
+            'description': food.get('description', ''),
+            'dataType': food.get('dataType', ''),
+            'publicationDate': food.get('publicationDate', ''),
+            'ndbNumber': food.get('ndbNumber', ''),
+            **{nutrient['number']: nutrient.get('amount', 0) for nutrient in food['foodNutrients']}
+        }
+
 
 class Explorer:
     """
     Class to manually explore the large csv files generated by CsvGenerator
+
+    In lazy mode, food_nutrients reads rows from the CSV file only when they are looked up, see LazyCsvRows,
+    and single food items are printed from it. This starts instantly and uses little memory for any file size.
     """
 
     NUTRIENT_DEFINITIONS_CSV = os.path.join(DATA_DIR, 'fdc_data', 'nutrient_definitions.csv')
     FOOD_NUTRIENTS_CSV = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients.csv')
+    FOOD_NUTRIENTS_PARQUET = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients.parquet')
+    FOOD_NUTRIENTS_CSR_DIR = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients_csr')
+    FOOD_NUTRIENTS_INDEX_DIR = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients_index')
+
+    def __init__(self, lazy: bool = False):
+        self.lazy = lazy
 
     @cached_property
     def nutrients(self) -> dict[str, NutrientDict]:
@@ -364,15 +731,96 @@ class Explorer:
             return {row['number']: row for row in reader}  # noqa
 
     @cached_property
-    def food_nutrients(self) -> dict[str, dict[str, str]]:
+    def food_nutrients(self) -> Mapping[str, dict[str, str]]:
         """
         Return the food nutrients for a given food item
         """
 
+        if self.lazy:
+            return LazyCsvRows(self.FOOD_NUTRIENTS_CSV)
         with open(self.FOOD_NUTRIENTS_CSV) as f:
             reader = csv.DictReader(f, delimiter=';')
             return {row['fdcId']: row for row in reader}  # noqa
 
+    @cached_property
+    def food_nutrients_table(self) -> pd.DataFrame:
+        """
+        Return all food nutrients from the Parquet file, indexed by fdcId, with float32 amounts (NaN if missing).
+        If the Parquet file has not been generated, the CSV file is read instead
+        """
+
+        if os.path.exists(self.FOOD_NUTRIENTS_PARQUET):
+            return self.read_food_nutrients()
+
+        df = pd.read_csv(self.FOOD_NUTRIENTS_CSV, delimiter=';', dtype=str, keep_default_na=False)
+        nutrient_columns = df.columns[len(CsvGenerator.FOOD_FIELD_NAMES):]
+        df[nutrient_columns] = df[nutrient_columns].apply(pd.to_numeric).astype('float32')
+        df['fdcId'] = df['fdcId'].astype('int64')
+        return df.set_index('fdcId')
+
+    @cached_property
+    def food_nutrients_csr(self) -> SparseFoodNutrients:
+        """
+        Return all food nutrients as a memory-mapped sparse matrix, generated by CsvGenerator
+        """
+
+        return load_sparse_food_nutrients(self.FOOD_NUTRIENTS_CSR_DIR)
+
+    @cached_property
+    def food_index(self) -> FoodIndex:
+        """
+        Return the lookup indexes over the rows of food_nutrients_table, see fdc_index.
+        They are loaded from disk, and (re)built from the food nutrients file if it has changed since
+        """
+
+        source_file = self.FOOD_NUTRIENTS_PARQUET
+        if not os.path.exists(source_file):
+            source_file = self.FOOD_NUTRIENTS_CSV
+        source = file_fingerprint(source_file)
+
+        header_json = os.path.join(self.FOOD_NUTRIENTS_INDEX_DIR, 'header.json')
+        if os.path.exists(header_json):
+            index = load_food_index(self.FOOD_NUTRIENTS_INDEX_DIR)
+            if index.header['source'] == source:
+                return index
+
+        index = build_food_index(self.food_nutrients_table, source)
+        save_food_index(index, self.FOOD_NUTRIENTS_INDEX_DIR)
+        print(f'Successfully written the food index of {len(index.fdc_ids)} food items to {self.FOOD_NUTRIENTS_INDEX_DIR}')
+        return index
+
+    def find_foods(self, text: str) -> pd.DataFrame:
+        """
+        Find the food items whose description contains all words of the text, or words starting with them
+
+        :param text: Words to look for, e.g. 'chick pea'
+        :return: fdcId and description of the matching food items
+        """
+
+        return self.food_nutrients_table[['description']].iloc[self.food_index.search(text)]
+
+    def find_foods_in_nutrient_range(self, nutrient_number: str, minimum: float = None,
+                                     maximum: float = None) -> pd.DataFrame:
+        """
+        Find the food items with an amount of a nutrient between minimum and maximum (inclusive),
+        e.g. find_foods_in_nutrient_range('303', minimum=5) for iron >= 5 mg
+
+        :return: fdcId, description and amount of the matching food items, in ascending order of amount
+        """
+
+        rows = self.food_index.nutrient_range(nutrient_number, minimum, maximum)
+        return self.food_nutrients_table[['description', nutrient_number]].iloc[rows]
+
+    def read_food_nutrients(self, columns: list[str] = None) -> pd.DataFrame:
+        """
+        Read the food nutrients from the Parquet file generated by CsvGenerator, indexed by fdcId.
+        Only the given columns are read from the (memory-mapped) file, e.g. ['description'] or ['203', '204']
+
+        :param columns: Food fields and/or nutrient numbers to read. If None, all columns are read
+        """
+
+        return pd.read_parquet(self.FOOD_NUTRIENTS_PARQUET, columns=columns, memory_map=True)
+
     def print_snippet(self, path_to_file: str):
         """
         Print the first 5 lines and first 10 columns of the given CSV file
@@ -395,7 +843,10 @@ class Explorer:
         """
 
         names_json = os.path.join(DATA_DIR, 'fdc_data', 'exploration', 'food_item_names.json')
-        names = sorted([row['description'] for row in self.food_nutrients.values()])
+        if os.path.exists(self.FOOD_NUTRIENTS_PARQUET):
+            names = sorted(self.read_food_nutrients(['description'])['description'])
+        else:
+            names = sorted([row['description'] for row in self.food_nutrients.values()])
         with open(names_json, 'w') as f:
             json.dump(names, f, indent=2)
         return names_json
@@ -404,47 +855,103 @@ class Explorer:
         """
         Write per nutrient the number and name, and the top N foods with the highest amount of that nutrient
 
-        :param top_n: Path to the generated JSON file
+        :param top_n: Number of foods per nutrient
+        :return: Path to the generated JSON file
         """
 
-        top_n_per_nutrient_json = os.path.join(DATA_DIR, 'fdc_data', 'exploration', f'top_{top_n}_per_nutrient.json')
-        top_n_per_nutrient = {}
-        for nutrient_number, nutrient in self.nutrients.items():
-            nutrient_name = nutrient['name']
-            nutrient_unit_name = nutrient['unitName']
-            top_n_per_nutrient[nutrient_number] = {
-                'number': nutrient_number,
-                'name': nutrient_name,
-                'unitName': nutrient_unit_name,
-                'top_n_foods': sorted(
-                    [
+        return self.top_ns_per_nutrient([top_n])[0]
+
+    def top_ns_per_nutrient(self, top_ns: list[int]) -> list[str]:
+        """
+        Write the top N foods per nutrient for several values of N, e.g. [5, 10], from a single computation.
+        Missing amounts count as 0, and foods with the same amount are in the order of the food nutrients file
+
+        :param top_ns: Numbers of foods per nutrient
+        :return: Paths to the generated JSON files, one per N
+        """
+
+        table = self.food_nutrients_table
+        nutrient_numbers = [number for number in self.nutrients if number in table.columns]
+        matrix = table[nutrient_numbers].fillna(0).to_numpy(dtype=np.float32)
+        top_rows = self._top_n_rows(matrix, max(top_ns))
+        top_amounts = np.take_along_axis(matrix, top_rows, axis=0)
+        fdc_ids = table.index.astype(str).to_numpy()
+        descriptions = table['description'].to_numpy()
+        columns = {number: column for column, number in enumerate(nutrient_numbers)}
+
+        paths = []
+        for top_n in top_ns:
+            top_n_per_nutrient_json = os.path.join(DATA_DIR, 'fdc_data', 'exploration', f'top_{top_n}_per_nutrient.json')
+            top_n_per_nutrient = {}
+            for nutrient_number, nutrient in self.nutrients.items():
+                column = columns.get(nutrient_number)
+                rows = top_rows[:top_n, column] if column is not None else []
+                amounts = top_amounts[:top_n, column] if column is not None else []
+                top_n_per_nutrient[nutrient_number] = {
+                    'number': nutrient_number,
+                    'name': nutrient['name'],
+                    'unitName': nutrient['unitName'],
+                    'top_n_foods': [
                         {
-                            'fdcId': food['fdcId'],
-                            'description': food['description'],
-                            'amount': float(food[nutrient_number] or '0'),
+                            'fdcId': fdc_ids[row],
+                            'description': descriptions[row],
+                            # The shortest repr of the float32 amount, e.g. 5.88 instead of 5.880000114440918
+                            'amount': float(str(amount)),
                         }
-                        for food in self.food_nutrients.values()
-                        if nutrient_number in food
+                        for row, amount in zip(rows, amounts)
                     ],
-                    key=lambda x: x['amount'],
-                    reverse=True,
-                )[:top_n],
-            }
-        with open(top_n_per_nutrient_json, 'w') as f:
-            json.dump(top_n_per_nutrient, f, indent=2)
-        return top_n_per_nutrient_json
+                }
+            with open(top_n_per_nutrient_json, 'w') as f:
+                json.dump(top_n_per_nutrient, f, indent=2)
+            paths.append(top_n_per_nutrient_json)
+        return paths
+
+    @staticmethod
+    def _top_n_rows(matrix: np.ndarray, top_n: int) -> np.ndarray:
+        """
+        Row indices of the top N values of every column, in descending order of value, and in ascending order
+        of row for equal values. Only the top N are sorted, after selecting them with argpartition
+
+        :param matrix: Values with shape (rows x columns)
+        :param top_n: Number of rows per column. If there are fewer rows, all rows are returned
+        :return: Row indices with shape (min(top_n, rows) x columns)
+        """
+
+        nr_rows, nr_columns = matrix.shape
+        top_n = min(top_n, nr_rows)
+        if top_n == 0:
+            return np.zeros((0, nr_columns), dtype=np.intp)
+
+        # Nth highest value per column
+        threshold = np.take_along_axis(matrix, np.argpartition(-matrix, top_n - 1, axis=0)[top_n - 1:top_n], axis=0)
+
+        # All values above the threshold, and the first rows with a value equal to it
+        above = matrix > threshold
+        nr_equal_needed = top_n - above.sum(axis=0)
+        equal = matrix == threshold
+        selected = above | (equal & (np.cumsum(equal, axis=0, dtype=np.int32) <= nr_equal_needed))
+
+        # Exactly top_n selected rows per column, sorted by descending value and then by row
+        columns, rows = np.nonzero(selected.T)
+        rows = rows.reshape(nr_columns, top_n).T
+        values = np.take_along_axis(matrix, rows, axis=0)
+        order = np.lexsort((rows, -values), axis=0)
+        return np.take_along_axis(rows, order, axis=0)
 
     def print_food_item(self, fdcid: int, energy_only: bool = False):
         """
         Print the food item with the given FDC ID and the specified nutrients
         """
 
-        food = self.food_nutrients[str(fdcid)]
+        if self.lazy:
+            food = self.food_nutrients[str(fdcid)]
+        else:
+            food = self.food_nutrients_table.iloc[self.food_index.row(fdcid)].to_dict()
         print(f'Food item: {food["description"]}')
         for nutrient_number, nutrient in self.nutrients.items():
-            amount = food.get(nutrient_number, '')  # noqa
+            amount = food.get(nutrient_number)
             if amount and float(amount) > 0 and (not energy_only or 'Energy' in nutrient['name']):
-                print(f'{nutrient["name"]}: {amount} {nutrient["unitName"]}')
+                print(f'{nutrient["name"]}: {float(amount):g} {nutrient["unitName"]}')
 
 
 if __name__ == '__main__':
@@ -455,12 +962,17 @@ if __name__ == '__main__':
     csv_generator = CsvGenerator()
     csv_generator.generate_nutrient_definitions_csv()
     csv_generator.generate_food_nutrients_csv()
+    csv_generator.generate_food_nutrients_parquet()
+    csv_generator.generate_food_nutrients_csr()
 
     explorer = Explorer()
     explorer.print_snippet(explorer.FOOD_NUTRIENTS_CSV)
     explorer.write_food_item_names()
-    explorer.top_n_per_nutrient(10)
+    explorer.top_ns_per_nutrient([5, 10])
 
     for fcdid in [168271, 171029, 171400]:
         explorer.print_food_item(fcdid, energy_only=True)
         print()
+
+    print(explorer.find_foods('chick pea'))
+    print(explorer.find_foods_in_nutrient_range('303', minimum=5))  # Iron >= 5 mg
@@ -0,0 +1,225 @@
+import asyncio
+from collections import deque
+from typing import AsyncGenerator
+
+import aiohttp
+
+from common import JSON
+from fdc import FdcApi, FdcDataType, FoodDataCentral, FoodDict
+from fdc_cache import FileCache, ResponseCache
+
+
+class AsyncFoodDataCentral:
+    """
+    asyncio variant of FoodDataCentral, to interact with the USDA Food Data Central API from an event loop
+
+    It uses the same API key, URLs and cache backends as FoodDataCentral through fdc.FdcApi, so both clients
+    share their cached responses. At most `max_concurrency` requests to the API are made at the same time,
+    which lets bulk lookups overlap their network latency. Reads and writes of the cache are run in a thread,
+    so they do not block the event loop.
+
+    Usage:
+    async with AsyncFoodDataCentral() as fdc:
+        async for food in fdc.food_list():
+            ...
+        foods = await fdc.get_foods([168271, 171029, 171400])
+    """
+
+    def __init__(self, max_concurrency: int = 10, base_url: str = None, cache: ResponseCache = None,
+                 cache_ttls: dict[str, float] = None, memory_cache_size: int = 64):
+        """
+        :param max_concurrency: Maximum number of concurrent requests to the API
+        :param base_url: Base URL of the API, e.g. to use a local stub server instead of the real API
+        :param cache: Store of the cached responses, see FoodDataCentral
+        :param cache_ttls: Seconds after which cached responses expire, per endpoint, see FoodDataCentral
+        :param memory_cache_size: Number of responses to keep in memory in front of the cache, see FoodDataCentral
+        """
+
+        self.max_concurrency = max_concurrency
+        self.api = FdcApi(base_url or FoodDataCentral.BASE_URL, cache or FileCache(FoodDataCentral.CACHE_DIR),
+                          cache_ttls=cache_ttls, memory_cache_size=memory_cache_size)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the HTTP session, if it has been opened
+        """
+
+        if self.client_session is not None:
+            await self.client_session.close()
+            self.client_session = None
+
+    async def food_list(self, data_types: list[FdcDataType] = None) -> AsyncGenerator[FoodDict, None]:
+        """
+        Get an async iterator over all food items in the database of the given data type
+
+        :param data_types: Data types you are interested in.
+                           If None, food items from Foundation and SR Legacy are returned.
+        :return: Async generator over all food items with their nutrients in the FDC database
+        """
+
+        async for food in self._make_paginated_get_call('v1/foods/list', self.api.food_list_params(data_types)):
+            yield food
+
+    async def get_food(self, fdc_id: int, nutrients: list[str] = None) -> FoodDict:
+        """
+        Get a specific food item by its FDC ID
+
+        :param fdc_id: FDC identifier of the food item
+        :param nutrients: Nutrients you are interested in. If None, all nutrients are returned
+        :return: Food item with its nutrients for the given FDC ID
+        """
+
+        url = f'v1/food/{fdc_id}'
+        nutrients = ','.join(nutrients) if nutrients else None
+        return await self._make_get_call(url, params={'nutrients': nutrients})  # noqa
+
+    async def get_foods(self, fdc_ids: list[int], nutrients: list[str] = None) -> list[FoodDict]:
+        """
+        Get multiple food items by their FDC IDs, with one API call per 20 food items that are not cached yet.
+        These calls are made concurrently, up to `max_concurrency` at the same time.
+        Every food item is cached separately, like FoodDataCentral.get_foods does.
+
+        :param fdc_ids: FDC identifiers of the food items
+        :param nutrients: Nutrients you are interested in. If None, all nutrients are returned
+        :return: Food items with their nutrients, in the order of the given FDC IDs. Unknown FDC IDs are left out
+        """
+
+        urls, foods, missing_fdc_ids = await asyncio.to_thread(self.api.get_foods_from_cache, fdc_ids, nutrients)
+        max_foods_per_call = FoodDataCentral.MAX_FOODS_PER_CALL
+        batches = [
+            missing_fdc_ids[start:start + max_foods_per_call]
+            for start in range(0, len(missing_fdc_ids), max_foods_per_call)
+        ]
+        responses = await asyncio.gather(
+            *(self._make_post_call('v1/foods', self.api.get_foods_body(batch, nutrients)) for batch in batches)
+        )
+        new_foods = [food for response in responses for food in response]
+        for food in new_foods:
+            foods[food['fdcId']] = food
+        await asyncio.to_thread(self.api.add_responses_to_cache, {urls[food['fdcId']]: food for food in new_foods})
+        return [foods[fdc_id] for fdc_id in fdc_ids if foods.get(fdc_id) is not None]
+
+    async def _make_paginated_get_call(self, url: str, params: dict = None) -> AsyncGenerator[JSON, None]:
+        """
+        Make a paginated GET call to the API, fetching multiple pages concurrently
+
+        :param url: URL to make the GET call to
+        :param params: Parameters to pass in the GET call. This could include a `pageSize`,
+                       but if not provided, it will default to 50
+        :return: Async generator over all items in the paginated response, in page order
+        """
+
+        params = params or {}
+        if 'pageSize' not in params:
+            params['pageSize'] = 50
+
+        pending = deque()  # Tasks of the requested pages, in page order
+        next_page = 1
+        end_seen = False
+        try:
+            while True:
+                # Request new pages while the end has not been seen, within the concurrency and rate limits
+                while not end_seen and len(pending) < self.api.max_calls_in_flight(self.max_concurrency):
+                    pending.append(asyncio.ensure_future(
+                        self._make_get_call(url, {**params, 'pageNumber': next_page}, use_memory_cache=False)))
+                    next_page += 1
+                if not pending:
+                    break
+
+                data = await pending.popleft()
+                if not data:
+                    break
+                # Verify that the returned data is indeed a list to yield from
+                if not isinstance(data, list):
+                    raise ValueError(f'Expected a list, but got {type(data)}')
+                end_seen = end_seen or any(
+                    task.done() and not task.cancelled() and task.exception() is None and not task.result()
+                    for task in pending
+                )
+                for item in data:
+                    yield item
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _make_get_call(self, url: str, params: dict = None, use_memory_cache: bool = True) -> JSON:
+        """
+        Make a GET call to the API
+
+        :param url: URL to make the GET call to
+        :param params: Parameters to pass in the GET call
+        :param use_memory_cache: Whether the cached response may be kept in memory, see FoodDataCentral
+        """
+
+        url = self.api.build_url(url, params)
+
+        # Check if the response is already in the cache and has not expired yet
+        entry = await asyncio.to_thread(self.api.get_cache_entry, url, use_memory_cache)
+        if entry is not None and self.api.is_fresh(url, entry):
+            return entry['data']
+
+        # If not, get the response from the API and add it to the cache.
+        # An expired response is revalidated, so it is not downloaded again if it has not changed
+        async with self.semaphore:
+            async with self._get_client_session().get(url, params={'api_key': self.api.api_key},
+                                                      headers=self.api.revalidation_headers(entry)) as response:
+                if response.status != 304:
+                    response.raise_for_status()
+                    data = await response.json()
+
+        ratelimit = self.api.update_ratelimit(response.headers)
+        if response.status == 304:
+            await asyncio.to_thread(self.api.touch, url)
+            print(f'Revalidated cached response from {url}. Remaining calls: {ratelimit}')
+            return entry['data']
+
+        await asyncio.to_thread(self.api.add_response_to_cache, url, data, response.headers)
+        print(f'Added response from {url} to cache. Remaining calls: {ratelimit}')
+        return data
+
+    async def _make_post_call(self, url: str, body: dict) -> JSON:
+        """
+        Make a POST call to the API. POST calls are not cached
+
+        :param url: URL to make the POST call to
+        :param body: JSON body of the POST call
+        """
+
+        url = self.api.build_url(url)
+        async with self.semaphore:
+            async with self._get_client_session().post(url, params={'api_key': self.api.api_key},
+                                                       json=body) as response:
+                response.raise_for_status()
+                data = await response.json()
+
+        ratelimit = self.api.update_ratelimit(response.headers)
+        print(f'Made POST call to {url}. Remaining calls: {ratelimit}')
+        return data
+
+    def _get_client_session(self) -> aiohttp.ClientSession:
+        """
+        Get the HTTP session, opening it on first use (it needs a running event loop)
+        """
+
+        if self.client_session is None:
+            self.client_session = aiohttp.ClientSession()
+        return self.client_session
+
+
+if __name__ == '__main__':
+    async def main():
+        async with AsyncFoodDataCentral() as fdc:
+            foods = [food async for food in fdc.food_list()]
+            print(len(foods))
+            for food in await fdc.get_foods([168271, 171029, 171400]):
+                print(food['description'])
+
+    asyncio.run(main())
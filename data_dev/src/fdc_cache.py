@@ -0,0 +1,669 @@
+import base64
+import glob
+import hashlib
+import json
+import os.path
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, TypedDict
+
+from common import DATA_DIR, JSON
+
+FDC_CACHE_DIR = os.path.join(DATA_DIR, 'fdc_cache')
+FDC_CACHE_SQLITE = os.path.join(FDC_CACHE_DIR, 'fdc_cache.sqlite')
+
+
+class CacheEntry(TypedDict):
+    """
+    Example of a cache entry:
+    {
+        "data": { ... },
+        "fetched_at": 1718000000.0,
+        "etag": "\"5f3a-1c2b\"",
+        "last_modified": "Thu, 18 Apr 2024 00:00:00 GMT",
+        "size": 5120
+    }
+    The fetch time is the Unix time at which the response was last downloaded or revalidated,
+    the ETag and Last-Modified are the validators of the response (if any), and the size is in bytes on disk.
+    """
+
+    data: JSON
+    fetched_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: int
+
+
+class ResponseCache(ABC):
+    """
+    Base class of the stores of cached API responses, keyed by the hash of the request URL
+
+    With a `max_size` in bytes, the least recently used entries are evicted once the cache grows beyond it,
+    until it is back below EVICTION_RATIO times that size. Reads are only tracked when there is a `max_size`.
+    A cache can be shared between threads, e.g. the workers that fetch the pages of a paginated call.
+    """
+
+    EVICTION_RATIO = 0.9
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size
+        self.total_size = None  # Computed on the first write that needs it
+        self.size_lock = threading.Lock()  # Guards total_size and the evictions
+
+    @abstractmethod
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get the cached entry for the given key, or None if it is not in the cache
+        """
+
+    def get_entries(self, keys: Iterable[str]) -> dict[str, CacheEntry]:
+        """
+        Get the cached entries for the given keys. Keys that are not in the cache are left out
+        """
+
+        entries = {key: self.get_entry(key) for key in keys}
+        return {key: entry for key, entry in entries.items() if entry is not None}
+
+    def get(self, key: str) -> JSON:
+        """
+        Get the cached response for the given key, or None if it is not in the cache
+        """
+
+        entry = self.get_entry(key)
+        return None if entry is None else entry['data']
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, JSON]:
+        """
+        Get the cached responses for the given keys. Keys that are not in the cache are left out
+        """
+
+        return {key: entry['data'] for key, entry in self.get_entries(keys).items()}
+
+    def put(self, key: str, data: JSON, etag: str = None, last_modified: str = None):
+        """
+        Add a response to the cache, fetched now, replacing the response with the same key
+        """
+
+        self.put_entries({key: {'data': data, 'fetched_at': time.time(), 'etag': etag, 'last_modified': last_modified}})
+
+    def put_many(self, responses: dict[str, JSON]):
+        """
+        Add multiple responses without validators to the cache, fetched now
+        """
+
+        fetched_at = time.time()
+        self.put_entries({
+            key: {'data': data, 'fetched_at': fetched_at, 'etag': None, 'last_modified': None}
+            for key, data in responses.items()
+        })
+
+    def put_entries(self, entries: dict[str, CacheEntry]):
+        """
+        Add entries to the cache. Their size is determined by the cache, so it can be left out.
+        Afterwards, entries are evicted if the cache is larger than its maximum size
+        """
+
+        added_size = self._put_entries(entries)
+        if self.max_size is not None:
+            with self.size_lock:
+                if self.total_size is None:
+                    self.total_size = self.size()
+                else:
+                    self.total_size += added_size
+                if self.total_size > self.max_size:
+                    self.evict(int(self.max_size * self.EVICTION_RATIO))
+
+    @abstractmethod
+    def touch(self, key: str, fetched_at: float = None):
+        """
+        Mark a cached response as fetched at the given time (now by default), e.g. after it has been revalidated
+        """
+
+    @abstractmethod
+    def mark_used(self, keys: Iterable[str]):
+        """
+        Mark cached responses as used now, for the eviction of the least recently used entries, without reading them.
+        Like reads, this is only tracked when there is a `max_size`
+        """
+
+    @abstractmethod
+    def evict(self, max_size: int) -> int:
+        """
+        Remove the least recently used entries until the cache is at most `max_size` bytes
+
+        :return: Number of removed entries
+        """
+
+    @abstractmethod
+    def size(self) -> int:
+        """
+        Total size of the cached entries in bytes
+        """
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        """
+        Iterate over the keys of all cached responses
+        """
+
+    @abstractmethod
+    def _put_entries(self, entries: dict[str, CacheEntry]) -> int:
+        """
+        Write the entries
+
+        :return: Change of the total size of the cache in bytes
+        """
+
+
+class FileCache(ResponseCache):
+    """
+    Cache with one pretty-printed JSON file per response, named after the key
+
+    The modification time of a file is the fetch time of its response, and its access time the time it was
+    last used. Validators are stored next to it in a `{key}.meta.json` file, only for responses that have them.
+    """
+
+    META_SUFFIX = '.meta.json'
+
+    def __init__(self, cache_dir: str = FDC_CACHE_DIR, max_size: int = None):
+        super().__init__(max_size)
+        self.cache_dir = cache_dir
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        cache_file = os.path.join(self.cache_dir, f'{key}.json')
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+            stat = os.stat(cache_file)
+        except FileNotFoundError:
+            return None
+        if self.max_size is not None:
+            os.utime(cache_file, (time.time(), stat.st_mtime))
+
+        entry = {'data': data, 'fetched_at': stat.st_mtime, 'etag': None, 'last_modified': None, 'size': stat.st_size}
+        meta_file = os.path.join(self.cache_dir, f'{key}{self.META_SUFFIX}')
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                entry.update(json.load(f))
+        return entry
+
+    def touch(self, key: str, fetched_at: float = None):
+        fetched_at = fetched_at or time.time()
+        os.utime(os.path.join(self.cache_dir, f'{key}.json'), (fetched_at, fetched_at))
+
+    def mark_used(self, keys: Iterable[str]):
+        if self.max_size is None:
+            return
+        now = time.time()
+        for key in keys:
+            cache_file = os.path.join(self.cache_dir, f'{key}.json')
+            try:
+                os.utime(cache_file, (now, os.stat(cache_file).st_mtime))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, max_size: int) -> int:
+        files = []
+        for cache_file in self._cache_files():
+            stat = os.stat(cache_file)
+            files.append((stat.st_atime, stat.st_size, cache_file))
+        files.sort()
+
+        total_size = sum(size for _, size, _ in files)
+        nr_evicted = 0
+        for _, size, cache_file in files:
+            if total_size <= max_size:
+                break
+            os.remove(cache_file)
+            meta_file = cache_file[:-len('.json')] + self.META_SUFFIX
+            if os.path.exists(meta_file):
+                os.remove(meta_file)
+            total_size -= size
+            nr_evicted += 1
+        self.total_size = total_size
+        return nr_evicted
+
+    def size(self) -> int:
+        return sum(os.path.getsize(cache_file) for cache_file in self._cache_files())
+
+    def keys(self) -> Iterator[str]:
+        for cache_file in self._cache_files():
+            yield os.path.basename(cache_file)[:-len('.json')]
+
+    def _put_entries(self, entries: dict[str, CacheEntry]) -> int:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        added_size = 0
+        for key, entry in entries.items():
+            cache_file = os.path.join(self.cache_dir, f'{key}.json')
+            previous_size = os.path.getsize(cache_file) if os.path.exists(cache_file) else 0
+            with open(cache_file, 'w') as f:
+                json.dump(entry['data'], f, indent=2)
+            os.utime(cache_file, (entry['fetched_at'], entry['fetched_at']))
+            added_size += os.path.getsize(cache_file) - previous_size
+
+            meta_file = os.path.join(self.cache_dir, f'{key}{self.META_SUFFIX}')
+            if entry['etag'] is not None or entry['last_modified'] is not None:
+                with open(meta_file, 'w') as f:
+                    json.dump({'etag': entry['etag'], 'last_modified': entry['last_modified']}, f)
+            elif os.path.exists(meta_file):
+                os.remove(meta_file)
+        return added_size
+
+    def _cache_files(self) -> Iterator[str]:
+        for cache_file in glob.iglob(os.path.join(self.cache_dir, '*.json')):
+            if not cache_file.endswith(self.META_SUFFIX):
+                yield cache_file
+
+
+class SqliteCache(ResponseCache):
+    """
+    Cache with all responses in a single SQLite database, as zlib-compressed compact JSON
+
+    Compared to FileCache, this avoids one file per response, and lets many responses be read or written
+    with a single query. The connection is shared between threads, guarded by a lock.
+    """
+
+    # Maximum number of keys per query, to stay below SQLite's limit of variables per statement
+    BATCH_SIZE = 500
+
+    COLUMNS = {
+        'fetched_at': 'REAL NOT NULL DEFAULT 0',
+        'etag': 'TEXT',
+        'last_modified': 'TEXT',
+        'size': 'INTEGER NOT NULL DEFAULT 0',
+        'accessed_at': 'REAL NOT NULL DEFAULT 0',
+    }
+
+    def __init__(self, path: str = FDC_CACHE_SQLITE, max_size: int = None):
+        super().__init__(max_size)
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, data BLOB NOT NULL)')
+            # Add the metadata columns to databases that were created without them
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(responses)')}
+            for column, definition in self.COLUMNS.items():
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE responses ADD COLUMN {column} {definition}')
+            if 'size' not in columns:
+                self.connection.execute('UPDATE responses SET size = length(data)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        return self.get_entries([key]).get(key)
+
+    def get_entries(self, keys: Iterable[str]) -> dict[str, CacheEntry]:
+        keys = list(keys)
+        entries = {}
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            batch = keys[start:start + self.BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            with self.lock:
+                rows = self.connection.execute(
+                    f'SELECT key, data, fetched_at, etag, last_modified, size FROM responses WHERE key IN ({placeholders})',
+                    batch
+                ).fetchall()
+                if self.max_size is not None and rows:
+                    with self.connection:
+                        self.connection.execute(
+                            f'UPDATE responses SET accessed_at = ? WHERE key IN ({placeholders})', [time.time(), *batch]
+                        )
+            entries.update({
+                key: {'data': self._decode(data), 'fetched_at': fetched_at, 'etag': etag,
+                      'last_modified': last_modified, 'size': size}
+                for key, data, fetched_at, etag, last_modified, size in rows
+            })
+        return entries
+
+    def touch(self, key: str, fetched_at: float = None):
+        fetched_at = fetched_at or time.time()
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?',
+                                    (fetched_at, fetched_at, key))
+
+    def mark_used(self, keys: Iterable[str]):
+        if self.max_size is None:
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?', [(now, key) for key in keys])
+
+    def evict(self, max_size: int) -> int:
+        with self.lock, self.connection:
+            rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+            total_size = sum(size for _, size in rows)
+            evicted = []
+            for key, size in rows:
+                if total_size <= max_size:
+                    break
+                evicted.append((key,))
+                total_size -= size
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+        self.total_size = total_size
+        return len(evicted)
+
+    def size(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def keys(self) -> Iterator[str]:
+        with self.lock:
+            keys = [key for key, in self.connection.execute('SELECT key FROM responses')]
+        yield from keys
+
+    def close(self):
+        self.connection.close()
+
+    def _put_entries(self, entries: dict[str, CacheEntry]) -> int:
+        rows = []
+        for key, entry in entries.items():
+            data = self._encode(entry['data'])
+            rows.append((key, data, entry['fetched_at'], entry['etag'], entry['last_modified'], len(data),
+                         entry['fetched_at']))
+        with self.lock, self.connection:
+            previous_size = 0
+            if self.max_size is not None:
+                for start in range(0, len(rows), self.BATCH_SIZE):
+                    batch = [row[0] for row in rows[start:start + self.BATCH_SIZE]]
+                    placeholders = ','.join('?' * len(batch))
+                    previous_size += self.connection.execute(
+                        f'SELECT COALESCE(SUM(size), 0) FROM responses WHERE key IN ({placeholders})', batch
+                    ).fetchone()[0]
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO responses (key, data, fetched_at, etag, last_modified, size, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+            )
+        return sum(row[5] for row in rows) - previous_size
+
+    @staticmethod
+    def _encode(data: JSON) -> bytes:
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def _decode(data: bytes) -> JSON:
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class MemoryCache(ResponseCache):
+    """
+    In-process LRU cache of at most `max_entries` entries in front of another cache, e.g. a FileCache
+
+    Reads are served from memory when possible and otherwise read from the other cache and kept in memory.
+    Reads served from memory are still marked as used in the other cache, so its least recently used entries
+    are the ones that are evicted. Writes go to the other cache, which evicts entries from disk when it has
+    a `max_size`. The number of reads that were served from memory is counted in `hits`, the others in `misses`.
+    Entries read from memory are the same objects every time, so they should not be modified.
+    """
+
+    def __init__(self, backend: ResponseCache, max_entries: int = 64):
+        super().__init__()
+        self.backend = backend
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        return self.get_entries([key]).get(key)
+
+    def get_entries(self, keys: Iterable[str]) -> dict[str, CacheEntry]:
+        entries = {}
+        missing_keys = []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    entries[key] = self.entries[key]
+                else:
+                    missing_keys.append(key)
+            self.hits += len(entries)
+            self.misses += len(missing_keys)
+
+        if entries:
+            self.backend.mark_used(entries)
+        if missing_keys:
+            backend_entries = self.backend.get_entries(missing_keys)
+            self._remember(backend_entries)
+            entries.update(backend_entries)
+        return entries
+
+    def _put_entries(self, entries: dict[str, CacheEntry]) -> int:
+        self.backend.put_entries(entries)
+        # Keep the entries as the backend would return them, including their size
+        with self.lock:
+            for key in entries:
+                self.entries.pop(key, None)
+        # The size is tracked by the backend, which evicts its own entries
+        return 0
+
+    def touch(self, key: str, fetched_at: float = None):
+        fetched_at = fetched_at or time.time()
+        self.backend.touch(key, fetched_at)
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = {**self.entries[key], 'fetched_at': fetched_at}
+
+    def mark_used(self, keys: Iterable[str]):
+        self.backend.mark_used(keys)
+
+    def evict(self, max_size: int) -> int:
+        with self.lock:
+            self.entries.clear()
+        return self.backend.evict(max_size)
+
+    def size(self) -> int:
+        return self.backend.size()
+
+    def keys(self) -> Iterator[str]:
+        return self.backend.keys()
+
+    def clear(self):
+        """
+        Remove all entries from memory and reset the counters. The backend is not changed
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _remember(self, entries: dict[str, CacheEntry]):
+        with self.lock:
+            for key, entry in entries.items():
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class CachedApi:
+    """
+    The parts of calling a JSON API with cached GET responses that do not depend on how the calls are made:
+    the URLs and their keys in the cache, the cache with the TTLs and validators of its responses,
+    and the number of remaining calls of the rate limit
+
+    API clients compose it with their own HTTP session, e.g. fdc.FoodDataCentral with requests and
+    fdc_async.AsyncFoodDataCentral with aiohttp, so they share their URLs and cached responses.
+    See FoodDataCentral for how the TTLs, validators and memory cache are used.
+    """
+
+    def __init__(self, base_url: str, cache: ResponseCache, cache_ttls: dict[str, float] = None,
+                 memory_cache_size: int = 64):
+        """
+        :param base_url: Base URL of the API
+        :param cache: Store of the cached responses
+        :param cache_ttls: Seconds after which cached responses expire, per endpoint, given as the start of the URL
+                           after the base URL. The longest matching endpoint is used.
+                           Responses of endpoints that are not listed never expire
+        :param memory_cache_size: Number of responses to keep in memory in front of the cache. If 0, none are kept
+        """
+
+        self.base_url = base_url
+        self.cache = cache
+        if memory_cache_size > 0 and not isinstance(self.cache, MemoryCache):
+            self.cache = MemoryCache(self.cache, max_entries=memory_cache_size)
+        self.cache_ttls = cache_ttls or {}
+        self.ratelimit_remaining = None
+
+    def build_url(self, url: str, params: dict = None) -> str:
+        """
+        Build the full URL of a call to the API, which is also the key of its response in the cache
+        """
+
+        # We build the URL with the parameters instead of passing them to the HTTP session,
+        # in order to have a consistent URL for the cache
+        url = f'{self.base_url}/{url}'
+        params = params or {}
+        url_params = '&'.join([f'{key}={value}' for key, value in params.items()])
+        if url_params:
+            url = f'{url}?{url_params}'
+        return url
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def hash_url(url: str) -> str:
+        """
+        Hash a URL to an alphanumeric string, the key of its response in the cache
+
+        >>> CachedApi.hash_url('https://example.com')
+        'EAaArVRs5qV39C9S3zO0z9ynVoWeZkuNfeMpsVDQnOk'
+        """
+
+        # Step 1: Hash the URL using SHA-256
+        url_hash = hashlib.sha256(url.encode('utf-8')).digest()
+
+        # Step 2: Encode the hash using base64
+        base64_encoded = base64.urlsafe_b64encode(url_hash).decode('utf-8')
+
+        # Step 3: Remove any '=' characters used as padding in base64 encoding
+        alphanumeric_hash = base64_encoded.rstrip('=')
+
+        return alphanumeric_hash
+
+    def get_cache_entry(self, url: str, use_memory_cache: bool = True) -> Optional[CacheEntry]:
+        """
+        Get the cache entry for a given URL, whether it has expired or not
+
+        :param use_memory_cache: If False, the entry is read from the cache behind the memory cache (if any),
+                                 without keeping it in memory, e.g. for pages that are only read once per pass
+        """
+
+        cache = self.cache
+        if not use_memory_cache and isinstance(cache, MemoryCache):
+            cache = cache.backend
+        return cache.get_entry(self.hash_url(url))
+
+    def get_responses_from_cache(self, urls: Iterable[str]) -> dict[str, JSON]:
+        """
+        Get the cached responses for multiple URLs at once. URLs that are not cached or have expired are left out
+        """
+
+        url_hashes = {self.hash_url(url): url for url in urls}
+        return {
+            url_hashes[url_hash]: entry['data']
+            for url_hash, entry in self.cache.get_entries(url_hashes).items()
+            if self.is_fresh(url_hashes[url_hash], entry)
+        }
+
+    def is_fresh(self, url: str, entry: CacheEntry) -> bool:
+        """
+        Check whether a cached response has not expired yet, given the TTL of its endpoint
+        """
+
+        endpoint = url[len(self.base_url):].lstrip('/')
+        matches = [prefix for prefix in self.cache_ttls if endpoint.startswith(prefix)]
+        if not matches:
+            return True
+        return time.time() - entry['fetched_at'] < self.cache_ttls[max(matches, key=len)]
+
+    @staticmethod
+    def revalidation_headers(entry: Optional[CacheEntry]) -> dict[str, str]:
+        """
+        Headers of a conditional GET call, given the validators of the cached response (if any)
+        """
+
+        headers = {}
+        if entry is not None and entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified'] is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def touch(self, url: str):
+        """
+        Mark the cached response of a URL as fetched now, after it has been revalidated
+        """
+
+        self.cache.touch(self.hash_url(url))
+
+    def add_response_to_cache(self, url: str, data: JSON, headers=None):
+        """
+        Add a response to the cache, with the ETag and Last-Modified validators from its headers
+        """
+
+        headers = headers or {}
+        self.cache.put(self.hash_url(url), data, etag=headers.get('ETag'), last_modified=headers.get('Last-Modified'))
+
+    def add_responses_to_cache(self, responses: dict[str, JSON]):
+        """
+        Add multiple responses to the cache at once, keyed by their URL
+        """
+
+        self.cache.put_many({self.hash_url(url): data for url, data in responses.items()})
+
+    def update_ratelimit(self, headers) -> str:
+        """
+        Keep track of the remaining API calls, given the headers of a response from the API
+
+        :return: The remaining and total number of calls, to print
+        """
+
+        ratelimit_remaining = headers.get('X-Ratelimit-Remaining')
+        ratelimit_limit = headers.get('X-Ratelimit-Limit')
+        if ratelimit_remaining is not None:
+            self.ratelimit_remaining = int(ratelimit_remaining)
+        return f'{ratelimit_remaining}/{ratelimit_limit}'
+
+    def max_calls_in_flight(self, max_concurrency: int) -> int:
+        """
+        Maximum number of concurrent calls, given the concurrency of the client and the remaining API calls
+        """
+
+        if self.ratelimit_remaining is None:
+            return max_concurrency
+        return max(1, min(max_concurrency, self.ratelimit_remaining))
+
+
+def migrate_cache(source: ResponseCache, target: ResponseCache, batch_size: int = 1000) -> int:
+    """
+    Copy all responses with their fetch times and validators from one cache to another,
+    e.g. from a FileCache to a SqliteCache
+
+    :return: Number of copied responses
+    """
+
+    nr_responses = 0
+    batch = {}
+    for key in source.keys():
+        batch[key] = source.get_entry(key)
+        if len(batch) >= batch_size:
+            target.put_entries(batch)
+            nr_responses += len(batch)
+            batch = {}
+    target.put_entries(batch)
+    nr_responses += len(batch)
+    return nr_responses
+
+
+if __name__ == '__main__':
+    nr_migrated = migrate_cache(FileCache(), SqliteCache())
+    print(f'Successfully migrated {nr_migrated} responses from {FDC_CACHE_DIR} to {FDC_CACHE_SQLITE}')
@@ -0,0 +1,260 @@
+import csv
+import json
+import os.path
+import re
+from collections.abc import Mapping
+from functools import cached_property
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_DIR, file_fingerprint
+
+FOOD_NUTRIENTS_INDEX_DIR = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients_index')
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+ARRAY_NAMES = ['fdc_ids', 'fdc_id_order', 'vocabulary', 'token_indptr', 'token_rows', 'nutrient_indptr',
+               'nutrient_values', 'nutrient_rows']
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase alphanumeric tokens
+
+    >>> tokenize('Beans, snap, green, raw (Includes foods for USDA\\'s Food Distribution Program)')[:4]
+    ['beans', 'snap', 'green', 'raw']
+    """
+
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class FoodIndex:
+    """
+    Lookup indexes over the rows of the food nutrients table, to answer exploration queries without a full scan
+
+    - fdcId to row: the FDC IDs in row order, and the rows that sort them, for a binary search
+    - description tokens to rows: the sorted vocabulary of tokens, with per token the sorted rows whose
+      description contains it (token_rows[token_indptr[t]:token_indptr[t + 1]])
+    - nutrient ranges: per nutrient column, the amounts of the foods that report it in ascending order, with their
+      rows (nutrient_values and nutrient_rows[nutrient_indptr[n]:nutrient_indptr[n + 1]])
+    """
+
+    def __init__(self, header: dict, arrays: dict[str, np.ndarray]):
+        self.header = header
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    @property
+    def nutrient_numbers(self) -> list[str]:
+        return self.header['nutrient_numbers']
+
+    @cached_property
+    def nutrient_index(self) -> dict[str, int]:
+        return {nutrient_number: column for column, nutrient_number in enumerate(self.nutrient_numbers)}
+
+    def row(self, fdc_id: int) -> int:
+        """
+        Row of the food item with the given FDC ID in the food nutrients table
+
+        :raises KeyError: If there is no food item with the given FDC ID
+        """
+
+        position = np.searchsorted(self.fdc_ids, fdc_id, sorter=self.fdc_id_order)
+        if position == len(self.fdc_ids) or self.fdc_ids[self.fdc_id_order[position]] != fdc_id:
+            raise KeyError(fdc_id)
+        return int(self.fdc_id_order[position])
+
+    def search(self, text: str) -> np.ndarray:
+        """
+        Rows of the food items whose description contains all tokens of the text, where every token may also be
+        the start of a longer token, e.g. 'chick pea' matches 'Chickpeas (garbanzo beans, bengal gram), mature seeds'
+
+        :return: Matching rows in ascending order
+        """
+
+        rows = None
+        for token in tokenize(text):
+            start = np.searchsorted(self.vocabulary, token, side='left')
+            end = np.searchsorted(self.vocabulary, token[:-1] + chr(ord(token[-1]) + 1), side='left')
+            token_rows = np.unique(self.token_rows[self.token_indptr[start]:self.token_indptr[end]])
+            rows = token_rows if rows is None else np.intersect1d(rows, token_rows, assume_unique=True)
+        return np.zeros(0, dtype=np.int32) if rows is None else rows
+
+    def nutrient_range(self, nutrient_number: str, minimum: float = None, maximum: float = None) -> np.ndarray:
+        """
+        Rows of the food items with an amount of the given nutrient between minimum and maximum (inclusive),
+        e.g. nutrient_range('303', minimum=5) for iron >= 5 mg. Food items that do not report it are left out
+
+        :return: Matching rows in ascending order of amount
+        """
+
+        column = self.nutrient_index.get(nutrient_number)
+        if column is None:
+            return np.zeros(0, dtype=np.int32)
+        start, end = self.nutrient_indptr[column], self.nutrient_indptr[column + 1]
+        values = self.nutrient_values[start:end]
+        low = 0 if minimum is None else np.searchsorted(values, minimum, side='left')
+        high = len(values) if maximum is None else np.searchsorted(values, maximum, side='right')
+        return self.nutrient_rows[start + low:start + high]
+
+
+def build_food_index(table: pd.DataFrame, source: dict = None) -> FoodIndex:
+    """
+    Build the indexes of a food nutrients table, see Explorer.food_nutrients_table
+
+    :param table: Food nutrients indexed by fdcId, with a description column and float nutrient columns
+    :param source: Fingerprint of the file the table was read from, to detect a stale index
+    """
+
+    fdc_ids = table.index.to_numpy(dtype=np.int64)
+
+    # Inverted index of the description tokens
+    rows_per_token = {}
+    for row, description in enumerate(table['description']):
+        for token in set(tokenize(description)):
+            rows_per_token.setdefault(token, []).append(row)
+    vocabulary = sorted(rows_per_token)
+    token_lengths = [len(rows_per_token[token]) for token in vocabulary]
+    token_rows = [row for token in vocabulary for row in rows_per_token[token]]
+
+    # Sorted amounts per nutrient, without the missing amounts
+    nutrient_numbers = [column for column in table.columns if pd.api.types.is_float_dtype(table[column])]
+    nutrient_values, nutrient_rows = [], []
+    for nutrient_number in nutrient_numbers:
+        values = table[nutrient_number].to_numpy(dtype=np.float32)
+        rows = np.flatnonzero(~np.isnan(values))
+        order = np.argsort(values[rows], kind='stable')
+        nutrient_values.append(values[rows][order])
+        nutrient_rows.append(rows[order])
+
+    arrays = {
+        'fdc_ids': fdc_ids,
+        'fdc_id_order': np.argsort(fdc_ids, kind='stable'),
+        'vocabulary': np.array(vocabulary, dtype=str),
+        'token_indptr': np.concatenate([[0], np.cumsum(token_lengths, dtype=np.int64)]),
+        'token_rows': np.array(token_rows, dtype=np.int32),
+        'nutrient_indptr': np.concatenate([[0], np.cumsum([len(rows) for rows in nutrient_rows], dtype=np.int64)]),
+        'nutrient_values': np.concatenate(nutrient_values or [np.zeros(0, dtype=np.float32)]),
+        'nutrient_rows': np.concatenate(nutrient_rows or [np.zeros(0, dtype=np.intp)]).astype(np.int32),
+    }
+    header = {'nutrient_numbers': nutrient_numbers, 'source': source}
+    return FoodIndex(header, arrays)
+
+
+def save_food_index(index: FoodIndex, path: str = FOOD_NUTRIENTS_INDEX_DIR) -> str:
+    """
+    Write the indexes to a directory, with one .npy file per array and the header in a JSON file
+
+    :return: Path to the directory
+    """
+
+    os.makedirs(path, exist_ok=True)
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(path, f'{name}.npy'), getattr(index, name))
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(index.header, f)
+    return path
+
+
+def load_food_index(path: str = FOOD_NUTRIENTS_INDEX_DIR) -> FoodIndex:
+    """
+    Load the indexes written by save_food_index, with the arrays as read-only memory maps
+    """
+
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+    return FoodIndex(header, arrays)
+
+
+class LazyCsvRows(Mapping):
+    """
+    Read-only mapping from the first column of a CSV file (e.g. fdcId) to its rows as dictionaries,
+    like {row['fdcId']: row for row in csv.DictReader(f)}, without reading the whole file into memory
+
+    The file is scanned once for the byte offset of every row, which is saved next to it in a `.offsets.npz`
+    file, and scanned again only when the CSV file has changed. Looking up a row seeks to its offset and parses
+    only that row. Rows may span multiple lines if they contain quoted newlines. The file is opened for every
+    lookup, so no file handle is kept open and the file can be replaced, e.g. by an incremental CsvGenerator run.
+    Every lookup checks the fingerprint of the file, and reloads the offsets if it has changed.
+    """
+
+    def __init__(self, csv_path: str, delimiter: str = ';'):
+        self.csv_path = csv_path
+        self.delimiter = delimiter
+        self.offsets_path = f'{csv_path}.offsets.npz'
+        self._load()
+
+    def _load(self):
+        """
+        Load the offsets and the field names of the current version of the CSV file
+        """
+
+        self.fingerprint = file_fingerprint(self.csv_path)
+        self.keys_array, self.offsets = self._load_or_build_offsets()
+        self.__dict__.pop('key_order', None)
+        self.field_names = self._read_row(0)
+
+    @cached_property
+    def key_order(self) -> np.ndarray:
+        return np.argsort(self.keys_array, kind='stable')
+
+    def __getitem__(self, key: str) -> dict[str, str]:
+        self._reload_if_changed()
+        key = str(key)
+        position = np.searchsorted(self.keys_array, key, sorter=self.key_order)
+        if position == len(self.keys_array) or self.keys_array[self.key_order[position]] != key:
+            raise KeyError(key)
+        return dict(zip(self.field_names, self._read_row(int(self.offsets[self.key_order[position]]))))
+
+    def __iter__(self) -> Iterator[str]:
+        self._reload_if_changed()
+        return (str(key) for key in self.keys_array)
+
+    def __len__(self) -> int:
+        self._reload_if_changed()
+        return len(self.keys_array)
+
+    def _reload_if_changed(self):
+        if file_fingerprint(self.csv_path) != self.fingerprint:
+            self._load()
+
+    def _read_row(self, offset: int) -> list[str]:
+        with open(self.csv_path, 'rb') as f:
+            f.seek(offset)
+            record = self.read_record(f)
+        return next(csv.reader([record.decode('utf-8')], delimiter=self.delimiter))
+
+    @staticmethod
+    def read_record(f) -> bytes:
+        """
+        Read the lines of one CSV record, up to the first line end outside of quotes
+        """
+
+        record = f.readline()
+        while record.count(b'"') % 2 and (line := f.readline()):
+            record += line
+        return record
+
+    def _load_or_build_offsets(self) -> tuple[np.ndarray, np.ndarray]:
+        fingerprint = self.fingerprint
+        if os.path.exists(self.offsets_path):
+            with np.load(self.offsets_path) as offsets_file:
+                if json.loads(str(offsets_file['source'])) == fingerprint:
+                    return offsets_file['keys'], offsets_file['offsets']
+
+        keys, offsets = [], []
+        with open(self.csv_path, 'rb') as f:
+            self.read_record(f)  # Header
+            while True:
+                offset = f.tell()
+                record = self.read_record(f)
+                if not record:
+                    break
+                keys.append(next(csv.reader([record.decode('utf-8')], delimiter=self.delimiter))[0])
+                offsets.append(offset)
+        keys, offsets = np.array(keys, dtype=str), np.array(offsets, dtype=np.int64)
+        np.savez(self.offsets_path, keys=keys, offsets=offsets, source=json.dumps(fingerprint))
+        return keys, offsets
@@ -0,0 +1,163 @@
+import json
+import os.path
+from array import array
+from functools import cached_property
+from typing import Iterable
+
+import numpy as np
+
+from common import DATA_DIR
+
+FOOD_NUTRIENTS_CSR_DIR = os.path.join(DATA_DIR, 'fdc_data', 'food_nutrients_csr')
+
+
+class SparseFoodNutrients:
+    """
+    Food nutrients as a sparse (foods x nutrients) matrix in CSR format
+
+    The amounts of the food item in row i are data[indptr[i]:indptr[i + 1]], for the nutrient columns
+    indices[indptr[i]:indptr[i + 1]] (sorted). Nutrients that a food item does not report are not stored,
+    which keeps large data types like Branded small enough to fit in memory.
+    Rows are in the order of fdc_ids, columns in the order of nutrient_numbers.
+    """
+
+    def __init__(self, fdc_ids: np.ndarray, nutrient_numbers: list[str], indptr: np.ndarray, indices: np.ndarray,
+                 data: np.ndarray):
+        self.fdc_ids = fdc_ids
+        self.nutrient_numbers = nutrient_numbers
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.fdc_ids), len(self.nutrient_numbers)
+
+    @cached_property
+    def row_index(self) -> dict[int, int]:
+        """
+        Row index per FDC ID
+        """
+
+        return {int(fdc_id): row for row, fdc_id in enumerate(self.fdc_ids)}
+
+    @cached_property
+    def column_index(self) -> dict[str, int]:
+        """
+        Column index per nutrient number
+        """
+
+        return {nutrient_number: column for column, nutrient_number in enumerate(self.nutrient_numbers)}
+
+    def row(self, fdc_id: int) -> dict[str, float]:
+        """
+        Amount per reported nutrient number of the food item with the given FDC ID
+        """
+
+        row = self.row_index[fdc_id]
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return {self.nutrient_numbers[column]: float(amount)
+                for column, amount in zip(self.indices[start:end], self.data[start:end])}
+
+    def columns(self, nutrient_numbers: list[str], rows: np.ndarray = None) -> np.ndarray:
+        """
+        Return a dense (foods x nutrients) float32 matrix with the given nutrient columns, e.g. as the nutrient
+        matrix A of diet_solver.solve_diet or gradient_descent.gradient_descent.
+        Nutrients that are not reported by a food item, or not known at all, are 0
+
+        :param nutrient_numbers: Nutrient numbers of the columns
+        :param rows: Row indices of the food items. If None, all food items are used
+        """
+
+        rows = np.arange(self.shape[0]) if rows is None else np.asarray(rows, dtype=np.intp)
+
+        # Map every stored column to its position in the result, or -1 if it is not requested
+        column_map = np.full(self.shape[1], -1, dtype=np.intp)
+        for position, nutrient_number in enumerate(nutrient_numbers):
+            if nutrient_number in self.column_index:
+                column_map[self.column_index[nutrient_number]] = position
+
+        # Gather the stored entries of the requested rows, as (result row, stored position) pairs
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        result_rows = np.repeat(np.arange(len(rows)), lengths)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        result = np.zeros((len(rows), len(nutrient_numbers)), dtype=np.float32)
+        result_columns = column_map[self.indices[positions]]
+        requested = result_columns >= 0
+        result[result_rows[requested], result_columns[requested]] = self.data[positions[requested]]
+        return result
+
+    def to_scipy(self):
+        """
+        Return the matrix as a scipy.sparse.csr_array that shares the arrays. This needs scipy,
+        which can be installed with `pip install scipy`
+        """
+
+        from scipy.sparse import csr_array
+
+        return csr_array((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def build_sparse_food_nutrients(foods: Iterable[dict]) -> SparseFoodNutrients:
+    """
+    Build the sparse matrix in a single pass over food items with their `foodNutrients`.
+    The nutrient columns are sorted by nutrient number, like the columns of food_nutrients.csv.
+    If a food item reports a nutrient more than once, the last amount is used
+
+    :param foods: Food items, e.g. from FoodDataCentral.food_list
+    """
+
+    fdc_ids = array('q')
+    indptr = array('q', [0])
+    indices = array('i')
+    data = array('f')
+    column_index = {}
+    for food in foods:
+        amounts = {}
+        for nutrient in food['foodNutrients']:
+            column = column_index.setdefault(nutrient['number'], len(column_index))
+            amounts[column] = nutrient.get('amount', 0)
+        fdc_ids.append(food['fdcId'])
+        indices.extend(amounts.keys())
+        data.extend(amounts.values())
+        indptr.append(len(indices))
+
+    # Renumber the columns in the order of the nutrient numbers and sort the columns within every row
+    nutrient_numbers = sorted(column_index)
+    renumber = np.empty(len(column_index), dtype=np.int32)
+    renumber[[column_index[nutrient_number] for nutrient_number in nutrient_numbers]] = np.arange(len(nutrient_numbers))
+    indptr = np.frombuffer(indptr, dtype=np.int64)
+    indices = renumber[np.frombuffer(indices, dtype=np.int32)]
+    rows = np.repeat(np.arange(len(fdc_ids)), np.diff(indptr))
+    order = np.lexsort((indices, rows))
+    return SparseFoodNutrients(np.frombuffer(fdc_ids, dtype=np.int64).copy(), nutrient_numbers, indptr.copy(),
+                               indices[order], np.frombuffer(data, dtype=np.float32)[order])
+
+
+def save_sparse_food_nutrients(sparse: SparseFoodNutrients, path: str = FOOD_NUTRIENTS_CSR_DIR) -> str:
+    """
+    Write the sparse matrix to a directory, with one .npy file per array and the nutrient numbers in a JSON file
+
+    :return: Path to the directory
+    """
+
+    os.makedirs(path, exist_ok=True)
+    for name in ['fdc_ids', 'indptr', 'indices', 'data']:
+        np.save(os.path.join(path, f'{name}.npy'), getattr(sparse, name))
+    with open(os.path.join(path, 'nutrient_numbers.json'), 'w') as f:
+        json.dump(sparse.nutrient_numbers, f)
+    return path
+
+
+def load_sparse_food_nutrients(path: str = FOOD_NUTRIENTS_CSR_DIR) -> SparseFoodNutrients:
+    """
+    Load a sparse matrix written by save_sparse_food_nutrients, with the arrays as read-only memory maps
+    """
+
+    with open(os.path.join(path, 'nutrient_numbers.json')) as f:
+        nutrient_numbers = json.load(f)
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+              for name in ['fdc_ids', 'indptr', 'indices', 'data']}
+    return SparseFoodNutrients(nutrient_numbers=nutrient_numbers, **arrays)
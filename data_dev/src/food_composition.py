@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os.path
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from common import REPO_DATA_DIR
+
+FOOD_COMPOSITION_CSV = os.path.join(REPO_DATA_DIR, 'WAFCT2019+PULSES.csv')
+FOOD_COMPOSITION_FILE = os.path.join(REPO_DATA_DIR, 'WAFCT2019+PULSES.fcm')
+
+# Columns of the food composition table that describe the food item instead of its nutrients
+FOOD_COLUMNS = ['Code', 'FOOD TYPE', 'Food name in English', 'Scientific name']
+
+MAGIC = b'NRFIFCM\0'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def clean_nutrient_value(value) -> float:
+    """
+    Convert a raw value from the food composition table to a float.
+    Values between brackets are estimates, e.g. "[0.3]", and are used as is.
+    Missing and unparseable values are treated as 0
+
+    >>> clean_nutrient_value('[0.3]')
+    0.3
+    >>> clean_nutrient_value('tr')
+    0.0
+    """
+
+    try:
+        value = float(str(value).replace('[', '').replace(']', '').strip())
+    except ValueError:
+        return 0.0
+    return 0.0 if np.isnan(value) else value
+
+
+class FoodComposition:
+    """
+    Food composition table as a dense (foods x nutrients) float32 matrix with nutrient values per 100g
+
+    The matrix is usually a read-only memory map of the file written by `build_food_composition`,
+    so loading it only parses the (small) JSON header. Rows are in the same order as in the CSV file.
+    """
+
+    def __init__(self, header: dict, matrix: np.ndarray):
+        self.header = header
+        self.matrix = matrix
+
+    @property
+    def nutrients(self) -> list[str]:
+        return self.header['nutrients']
+
+    @cached_property
+    def food_names(self) -> np.ndarray:
+        return np.array(self.header['food_names'], dtype=object)
+
+    @cached_property
+    def food_types(self) -> np.ndarray:
+        return np.array(self.header['food_types'], dtype=object)
+
+    @cached_property
+    def groups(self) -> dict[str, np.ndarray]:
+        """
+        Row indices of the food items per FOOD TYPE
+        """
+
+        return {food_type: np.array(rows, dtype=np.intp) for food_type, rows in self.header['groups'].items()}
+
+    @cached_property
+    def food_index(self) -> dict[str, int]:
+        """
+        Row index per food name. For duplicated names, the first row is used
+        """
+
+        food_index = {}
+        for row, food_name in enumerate(self.header['food_names']):
+            food_index.setdefault(food_name, row)
+        return food_index
+
+    def group_indices(self, food_types) -> dict[str, np.ndarray]:
+        """
+        Row indices of the food items for each of the given food types (empty if the type does not exist)
+        """
+
+        return {food_type: self.groups.get(food_type, np.zeros(0, dtype=np.intp)) for food_type in food_types}
+
+    def columns(self, nutrients: list[str]) -> np.ndarray:
+        """
+        Return a (foods x nutrients) matrix with the given nutrient columns.
+        Nutrients that are not in the food composition table are returned as columns of zeros
+        """
+
+        result = np.zeros((self.matrix.shape[0], len(nutrients)), dtype=np.float32)
+        nutrient_index = {nutrient: column for column, nutrient in enumerate(self.nutrients)}
+        for column, nutrient in enumerate(nutrients):
+            if nutrient in nutrient_index:
+                result[:, column] = self.matrix[:, nutrient_index[nutrient]]
+        return result
+
+
+def file_sha256(path: str) -> str:
+    """
+    SHA-256 hash of the contents of a file
+    """
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_food_composition(csv_path: str = FOOD_COMPOSITION_CSV, path: str = FOOD_COMPOSITION_FILE) -> str:
+    """
+    Clean the food composition CSV once and write it to a binary file that can be memory-mapped
+
+    File layout:
+    - 8 bytes magic (b'NRFIFCM\\0'), followed by the format version and the header length as uint32
+    - a UTF-8 JSON header with the schema: version, source file and hash, dtype, shape, nutrient names,
+      and per food item its code, name and FOOD TYPE, plus the row indices per FOOD TYPE
+    - padding up to a multiple of 64 bytes, followed by the C-ordered float32 (foods x nutrients) matrix
+
+    :param csv_path: Path to the food composition CSV file
+    :param path: Path to the binary file to write
+    :return: Path to the generated file
+    """
+
+    source_sha256 = file_sha256(csv_path)
+    food_data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    nutrients = [column for column in food_data.columns if column not in FOOD_COLUMNS]
+    matrix = np.zeros((len(food_data), len(nutrients)), dtype=np.float32)
+    for column, nutrient in enumerate(nutrients):
+        matrix[:, column] = [clean_nutrient_value(value) for value in food_data[nutrient]]
+
+    food_types = food_data['FOOD TYPE'].tolist()
+    groups = {}
+    for row, food_type in enumerate(food_types):
+        if food_type:
+            groups.setdefault(food_type, []).append(row)
+
+    header = {
+        'version': VERSION,
+        'source': os.path.basename(csv_path),
+        'source_sha256': source_sha256,
+        'dtype': 'float32',
+        'shape': list(matrix.shape),
+        'nutrients': nutrients,
+        'food_codes': food_data['Code'].tolist(),
+        'food_names': food_data['Food name in English'].tolist(),
+        'food_types': food_types,
+        'groups': groups,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = len(MAGIC) + 8 + len(header_bytes)
+    padding = -data_offset % ALIGNMENT
+
+    # Write to a temporary file first, so memory maps of a previous version of the file stay valid
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([VERSION, len(header_bytes)], dtype='<u4').tobytes())
+        f.write(header_bytes)
+        f.write(b'\0' * padding)
+        f.write(matrix.astype('<f4').tobytes())
+    os.replace(f'{path}.tmp', path)
+
+    print(f'Successfully written {matrix.shape[0]} foods x {matrix.shape[1]} nutrients to {path}')
+    return path
+
+
+def load_food_composition(path: str = FOOD_COMPOSITION_FILE) -> FoodComposition:
+    """
+    Load a food composition file written by `build_food_composition`, with the matrix as a read-only memory map
+    """
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a food composition file')
+        version, header_length = np.frombuffer(f.read(8), dtype='<u4')
+        if version != VERSION:
+            raise ValueError(f'Unsupported food composition file version {version}, expected {VERSION}')
+        header = json.loads(f.read(int(header_length)).decode('utf-8'))
+
+    data_offset = len(MAGIC) + 8 + int(header_length)
+    data_offset += -data_offset % ALIGNMENT
+    matrix = np.memmap(path, dtype='<f4', mode='r', offset=data_offset, shape=tuple(header['shape']))
+    return FoodComposition(header, matrix)
+
+
+def get_food_composition(path: str = FOOD_COMPOSITION_FILE, csv_path: str = FOOD_COMPOSITION_CSV) -> FoodComposition:
+    """
+    Load the food composition file, building it first from the CSV file if it does not exist yet,
+    or if the CSV file has changed since it was built (according to the source hash in its header)
+    """
+
+    if os.path.exists(path):
+        food_composition = load_food_composition(path)
+        if not os.path.exists(csv_path) or food_composition.header['source_sha256'] == file_sha256(csv_path):
+            return food_composition
+    build_food_composition(csv_path, path)
+    return load_food_composition(path)
+
+
+if __name__ == '__main__':
+    build_food_composition()
+    food_composition = load_food_composition()
+    print(f'Nutrients: {len(food_composition.nutrients)}, food types: {len(food_composition.groups)}')
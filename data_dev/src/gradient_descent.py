@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 import numpy as np
 
 # Set global print options for NumPy arrays
@@ -11,17 +13,66 @@ def get_error(obtained_nutrients, optimal_nutrients):
 
     This total error function can be optimized to account for different weights on each nutrient,
     and also to penalize under- or over-estimation of nutrients differently.
+
+    For 2-D inputs (targets x nutrients), the total error is calculated per target.
     """
 
     relative_error = (obtained_nutrients - optimal_nutrients) / optimal_nutrients
-    return np.sqrt(np.sum(relative_error ** 2))
+    return np.sqrt(np.sum(relative_error ** 2, axis=-1))
+
+
+OPTIMIZERS = ['gradient_descent', 'adam', 'nesterov', 'line_search']
+
+
+def gradient_descent(A, optimal_nutrients, learning_rate=None, max_iterations=100_000, tolerance=1e-5,
+                     optimizer='gradient_descent', return_iterations=False, initial_weights=None):
+    """
+    Find non-negative weights per food, such that the obtained nutrients A.T @ weights match the optimal nutrients.
+    It stops when the error of get_error is below the tolerance.
 
+    Optimizers:
+    - 'gradient_descent': gradient descent on the squared error, with a fixed learning rate (default 1e-6)
+      that has to be tuned per dataset
+    - 'adam': Adam, with a learning rate (default 0.1) in the units of the weights
+    - 'nesterov': Nesterov accelerated gradient, with a step of 1 / Lipschitz constant of the gradient
+      unless a learning rate is given
+    - 'line_search': steepest descent with an exact line search, leaving out the weights that are stuck at 0
+    The last three minimize the squared relative error, the same error as get_error, which makes them
+    independent of the units of the nutrients. After every step, negative weights are clipped to 0.
+
+    The weights start from initial_weights if given (e.g. the solution of a similar problem), else at random.
+
+    :return: The weights, or (weights, iterations) if return_iterations is True.
+             If the weights did not converge, iterations is max_iterations
+    """
 
-def gradient_descent(A, optimal_nutrients, learning_rate=1e-6, max_iterations=100_000, tolerance=1e-5):
     num_foods, _ = A.shape
-    weights = np.random.rand(num_foods)
+    if initial_weights is None:
+        weights = np.random.rand(num_foods)
+    else:
+        weights = np.clip(np.array(initial_weights, dtype=float), 0, None)
     # previous_cost = float('inf')
 
+    # Nutrients per food relative to the optimal nutrients, used by the optimizers on the relative error
+    relative_A = A / optimal_nutrients
+
+    # Set up the state of the optimizer. Every optimizer needs a branch here and in the loop below,
+    # so unknown optimizers are rejected before the first iteration instead of silently doing nothing
+    if optimizer == 'gradient_descent':
+        if learning_rate is None:
+            learning_rate = 1e-6
+    elif optimizer == 'adam':
+        if learning_rate is None:
+            learning_rate = 0.1
+        first_moment = np.zeros(num_foods)
+        second_moment = np.zeros(num_foods)
+    elif optimizer == 'nesterov':
+        if learning_rate is None:
+            learning_rate = 1 / (2 * np.linalg.norm(relative_A, 2) ** 2)
+        momentum_weights = weights
+    elif optimizer != 'line_search':
+        raise ValueError(f'Unknown optimizer {optimizer}, expected one of {OPTIMIZERS}')
+
     for iteration in range(max_iterations):
         obtained_nutrients = A.T @ weights
         cost = get_error(obtained_nutrients, optimal_nutrients)
@@ -32,21 +83,174 @@ def gradient_descent(A, optimal_nutrients, learning_rate=1e-6, max_iterations=10
             break
         # previous_cost = cost
 
-        error = obtained_nutrients - optimal_nutrients
-        gradient = 2 * A @ error / num_foods
-        # print(f'Iteration {iteration}')
-        # print(f'{cost=:.2f}')
-        # print(f'{weights=}')
-        # print(f'{obtained_nutrients=}')
-        # print(f'{optimal_nutrients=}')
-        # print(f'{error=}')
-        # print(f'{gradient=}')
-        weights -= learning_rate * gradient
-        weights = np.clip(weights, 0, None)
+        if optimizer == 'gradient_descent':
+            error = obtained_nutrients - optimal_nutrients
+            gradient = 2 * A @ error / num_foods
+            weights -= learning_rate * gradient
+            weights = np.clip(weights, 0, None)
+
+        elif optimizer == 'adam':
+            gradient = 2 * relative_A @ (relative_A.T @ weights - 1)
+            first_moment = 0.9 * first_moment + 0.1 * gradient
+            second_moment = 0.999 * second_moment + 0.001 * gradient ** 2
+            corrected_first_moment = first_moment / (1 - 0.9 ** (iteration + 1))
+            corrected_second_moment = second_moment / (1 - 0.999 ** (iteration + 1))
+            weights = weights - learning_rate * corrected_first_moment / (np.sqrt(corrected_second_moment) + 1e-8)
+            weights = np.clip(weights, 0, None)
 
+        elif optimizer == 'nesterov':
+            gradient = 2 * relative_A @ (relative_A.T @ momentum_weights - 1)
+            new_weights = np.clip(momentum_weights - learning_rate * gradient, 0, None)
+            momentum_weights = new_weights + iteration / (iteration + 3) * (new_weights - weights)
+            weights = new_weights
+
+        elif optimizer == 'line_search':
+            relative_error = relative_A.T @ weights - 1
+            direction = -2 * relative_A @ relative_error
+            direction[(weights <= 0) & (direction < 0)] = 0
+            # The relative error is quadratic along the direction, so the optimal step has a closed form
+            relative_direction = relative_A.T @ direction
+            if not np.any(relative_direction):
+                # Stalled at a stationary point above the tolerance, which is not converged
+                iteration = max_iterations
+                break
+            step = -(relative_error @ relative_direction) / (relative_direction @ relative_direction)
+            weights = np.clip(weights + step * direction, 0, None)
+    else:
+        iteration = max_iterations
+
+    if return_iterations:
+        return weights, iteration
     return weights
 
 
+def batched_gradient_descent(A, optimal_nutrients, learning_rate=1e-6, max_iterations=100_000, tolerance=1e-5):
+    """
+    Run gradient_descent for many target vectors at once
+
+    All weight vectors are updated in lockstep with matrix multiplications. Targets whose error drops below
+    the tolerance are taken out of the working set, so converged targets no longer consume compute.
+
+    :param A: Nutrients per food, shape (foods x nutrients)
+    :param optimal_nutrients: Target nutrients, shape (targets x nutrients)
+    :return: Weights per target, shape (targets x foods)
+    """
+
+    optimal_nutrients = np.atleast_2d(optimal_nutrients)
+    num_foods, _ = A.shape
+    num_targets, _ = optimal_nutrients.shape
+    weights = np.random.rand(num_targets, num_foods)
+
+    # Working set: indices of the targets that have not converged yet, with their weights and targets
+    active = np.arange(num_targets)
+    active_weights = weights.copy()
+    active_optimal_nutrients = optimal_nutrients
+
+    for iteration in range(max_iterations):
+        obtained_nutrients = active_weights @ A
+        cost = get_error(obtained_nutrients, active_optimal_nutrients)
+
+        converged = np.abs(cost) < tolerance
+        if np.any(converged):
+            weights[active[converged]] = active_weights[converged]
+            active = active[~converged]
+            active_weights = active_weights[~converged]
+            active_optimal_nutrients = active_optimal_nutrients[~converged]
+            obtained_nutrients = obtained_nutrients[~converged]
+            if len(active) == 0:
+                print(f"All {num_targets:,} targets converged after {iteration:,} iterations")
+                break
+
+        error = obtained_nutrients - active_optimal_nutrients
+        gradient = 2 * error @ A.T / num_foods
+        active_weights -= learning_rate * gradient
+        np.clip(active_weights, 0, None, out=active_weights)
+
+    weights[active] = active_weights
+    if len(active):
+        print(f"{num_targets - len(active):,} of {num_targets:,} targets converged")
+    return weights
+
+
+class SolutionCache:
+    """
+    Least recently used cache of solved weights per (country, year)
+
+    Requirements change smoothly from one year to the next, so the solution of a neighbouring year
+    is a good starting point for gradient_descent.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._solutions = OrderedDict()
+
+    def __len__(self):
+        return len(self._solutions)
+
+    def __contains__(self, key):
+        return key in self._solutions
+
+    def get(self, country, year):
+        """
+        Return the weights for the given country and year, or None if they are not in the cache
+        """
+
+        key = (country, year)
+        if key not in self._solutions:
+            return None
+        self._solutions.move_to_end(key)
+        return self._solutions[key]
+
+    def put(self, country, year, weights):
+        """
+        Add the weights for the given country and year, evicting the least recently used entry if the cache is full
+        """
+
+        key = (country, year)
+        self._solutions[key] = weights
+        self._solutions.move_to_end(key)
+        while len(self._solutions) > self.max_size:
+            self._solutions.popitem(last=False)
+
+    def nearest(self, country, year):
+        """
+        Return the weights of the closest cached year for the given country, or None if there is none
+        """
+
+        years = [cached_year for cached_country, cached_year in self._solutions if cached_country == country]
+        if not years:
+            return None
+        return self.get(country, min(years, key=lambda cached_year: abs(cached_year - year)))
+
+
+def sweep_years(A, optimal_nutrients_per_year, country, cache=None, **kwargs):
+    """
+    Run gradient_descent for consecutive years of a country, warm-starting each year from its neighbour's solution
+
+    :param A: Nutrients per food, shape (foods x nutrients)
+    :param optimal_nutrients_per_year: Dictionary mapping each year to its optimal nutrients
+    :param country: Country (or region) of the optimal nutrients, used as part of the cache key
+    :param cache: SolutionCache to reuse solutions from earlier sweeps. If None, a new cache is used
+    :param kwargs: Other arguments for gradient_descent, like the optimizer. return_iterations is not supported,
+                   since only the weights can be cached and used as initial weights
+    :return: Dictionary mapping each year to its weights
+    """
+
+    if kwargs.get('return_iterations'):
+        raise ValueError('sweep_years does not support return_iterations')
+    kwargs.pop('return_iterations', None)
+    cache = cache if cache is not None else SolutionCache()
+    solutions = {}
+    for year in sorted(optimal_nutrients_per_year):
+        weights = cache.get(country, year)
+        if weights is None:
+            weights = gradient_descent(A, optimal_nutrients_per_year[year],
+                                       initial_weights=cache.nearest(country, year), **kwargs)
+            cache.put(country, year, weights)
+        solutions[year] = weights
+    return solutions
+
+
 if __name__ == '__main__':
     use_real_example = True
 
@@ -78,3 +282,8 @@ if __name__ == '__main__':
     print(f'Optimal weights: {(100*weights).astype(int)}')
     print(f'Obtained nutrients: {(A.T @ weights).astype(int)}')
     print(f'Optimal nutrients: {optimal_nutrients}')
+
+    # Compare the optimizers that do not need a tuned learning rate
+    for optimizer in OPTIMIZERS[1:]:
+        weights, iterations = gradient_descent(A, optimal_nutrients, optimizer=optimizer, return_iterations=True)
+        print(f'{optimizer}: {iterations:,} iterations, obtained nutrients: {(A.T @ weights).astype(int)}')
@@ -5,6 +5,44 @@ from common import DATA_DIR
 
 nutrients_in_food_file = os.path.join(DATA_DIR, 'nutrients_in_food.csv')
 
+# Daily gram limits per FOOD TYPE of the meal plans, used by the Streamlit app and batch_meal_plans
+FOOD_GROUP_LIMITS = {
+    'DAIRY': 250,
+    'MEAT': 56,
+    'FISH': 28,
+    'FATS AND OILS': 40,
+    'GRAINS': 250,
+    'STARCHY ROOTS/TUBERS': 100,
+    'LEGUMES SOAKED & BOILED & DRAINED': 75,
+    'VEGETABLES': 400,
+    'FRUITS': 200,
+    'NUTS': 50,
+}
+
+# Nutrient needs that are taken into account in the meal plans, mapped to their (per 100g) column in the food
+# composition table. The needs use the bracketed names of COLUMN_MAPPING in nutrient_requirements, which differ
+# from the food composition table for niacin, folate and vitamin E. Other nutrient needs are not met by any food item
+NUTRIENT_COLUMNS = {
+    'Vitamin A (RAE, mcg)': 'Vitamin A (RAE, mcg)',
+    'Thiamine (vitamin B1) (mg)': 'Thiamine (vitamin B1) (mg)',
+    'Riboflavin (vitamin B2) (mg)': 'Riboflavin (vitamin B2) (mg)',
+    'Niacin equivalents or [niacin, preformed] (vitamin B3) (mg)':
+        'Niacin equivalents or niacin, preformed (vitamin B3) (mg)',
+    'Vitamin B6 (mg)': 'Vitamin B6 (mg)',
+    'Folate, total or [folate, sum of vitamers] (vitamin B9) (mcg)':
+        'Folate, total or folate, sum of vitamers (vitamin B9) (mcg)',
+    'Vitamin B12 (mcg)': 'Vitamin B12 (mcg)',
+    'Vitamin C (mg)': 'Vitamin C (mg)',
+    'Vitamin E (expressed in alpha-tocopherol equivalents) or [alpha-tocopherol] (mg)':
+        'Vitamin E (expressed in alpha-tocopherol equivalents) or alpha-tocopherol (mg)',
+    'Calcium (mg)': 'Calcium (mg)',
+    'Potassium (mg)': 'Potassium (mg)',
+    'Copper (mg)': 'Copper (mg)',
+    'Iron (mg)': 'Iron (mg)',
+    'Magnesium (mg)': 'Magnesium (mg)',
+    'Zinc (mg)': 'Zinc (mg)',
+}
+
 
 def get_nutrients_in_food():
     with open(nutrients_in_food_file, encoding='utf-8') as f:
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os.path
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_DIR, REPO_DATA_DIR
+
+FEMALE_POPULATION_URL = 'https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/main/UN_PPP2022_Forecast_PopulationBySingleAge_Female.csv'
+MALE_POPULATION_URL = 'https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/main/UN_PPP2022_Forecast_PopulationBySingleAge_Male.csv'
+BIRTH_RATE_URL = 'https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/UN_PPP2024_Output_Birth%20rate_Single_Year_per_1000_women.csv'
+GROUPS_CSV = os.path.join(REPO_DATA_DIR, 'GROUPS~1.CSV')
+NUTRIENT_NEEDS_CSV = os.path.join(REPO_DATA_DIR, 'result_sum_adj_df.csv')
+NUTRIENT_NEEDS_STATE_DIR = os.path.join(DATA_DIR, 'nutrient_needs_state')
+
+REGION_COLUMN = 'Region, subregion, country or area'
+
+# Single ages 0 to 100, where 100 stands for 100+
+AGES = np.arange(101)
+AGE_COLUMNS = [str(age) for age in AGES[:-1]] + ['100+']
+
+# Population categories along the sex axis. Pregnant and breastfeeding women are not counted as Female
+SEXES = ['Male', 'Female', 'Pregnant', 'Breastfeeding']
+
+# Nutrients of GROUPS~1.CSV and their column names in result_sum_adj_df
+COLUMN_MAPPING = {
+    'Vitamin A': 'Vitamin A (RAE, mcg)',
+    'Vitamin B1': 'Thiamine (vitamin B1) (mg)',
+    'Vitamin B2': 'Riboflavin (vitamin B2) (mg)',
+    'Vitamin B3': 'Niacin equivalents or [niacin, preformed] (vitamin B3) (mg)',
+    'Vitamin B6': 'Vitamin B6 (mg)',
+    'Vitamin B9': 'Folate, total or [folate, sum of vitamers] (vitamin B9) (mcg)',
+    'Vitamin B12': 'Vitamin B12 (mcg)',
+    'Vitamin C': 'Vitamin C (mg)',
+    'Vitamin E': 'Vitamin E (expressed in alpha-tocopherol equivalents) or [alpha-tocopherol] (mg)',
+    'Calcium': 'Calcium (mg)',
+    'Copper': 'Copper (mg)',
+    'Iron heme': 'Iron (mg)',
+    'Magnesium': 'Magnesium (mg)',
+    'Phosporus': 'Phosphorus (mg)',
+    'Potassium': 'Potassium (mg)',
+    'Zinc': 'Zinc (mg)',
+}
+
+
+def parse_age_range(age_range: str) -> tuple[int, int]:
+    """
+    Parse an age group of GROUPS~1.CSV into its first and last age (inclusive)
+
+    >>> parse_age_range('0')
+    (0, 0)
+    >>> parse_age_range('71-100+')
+    (71, 100)
+    """
+
+    first, _, last = age_range.partition('-')
+    return int(first), int((last or first).rstrip('+'))
+
+
+def single_age_array(df: pd.DataFrame, keys: pd.MultiIndex) -> np.ndarray:
+    """
+    Values per single age for the given (region, year) keys, with shape (keys x ages).
+    Ages that are not in the table, and missing or non-numeric values, are 0
+
+    :param df: Table with the region, the year and one column per single age ('0' to '99' and '100+')
+    :param keys: (region, year) pairs, which all have to be in the table
+    """
+
+    df = df.set_index([REGION_COLUMN, 'Year'])
+    df = df[~df.index.duplicated()].reindex(index=keys, columns=AGE_COLUMNS)
+    return df.apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+def grid_positions(keys: pd.MultiIndex) -> tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Positions of (region, year) pairs in a (regions x years) grid
+
+    :return: The regions in order of appearance, the sorted years, and the region and year index of every pair
+    """
+
+    regions = keys.get_level_values(0).unique()
+    years = np.sort(keys.get_level_values(1).unique())
+    return regions, years, regions.get_indexer(keys.get_level_values(0)), years.searchsorted(keys.get_level_values(1))
+
+
+def population_keys(female_df: pd.DataFrame, male_df: pd.DataFrame, birth_rate_df: pd.DataFrame) -> pd.MultiIndex:
+    """
+    The (region, year) pairs in all three tables, in the order of the female table.
+    Rows of the birth rate table with missing rates are left out
+    """
+
+    birth_rates = birth_rate_df[birth_rate_df.columns[2:]].apply(pd.to_numeric, errors='coerce')
+    birth_rate_df = birth_rate_df[birth_rates.notna().all(axis=1)]
+
+    keys = pd.MultiIndex.from_frame(female_df[[REGION_COLUMN, 'Year']]).drop_duplicates()
+    for df in [male_df, birth_rate_df]:
+        keys = keys[keys.isin(pd.MultiIndex.from_frame(df[[REGION_COLUMN, 'Year']]))]
+    return keys
+
+
+def population_array(female_df: pd.DataFrame, male_df: pd.DataFrame,
+                     birth_rate_df: pd.DataFrame) -> tuple[pd.MultiIndex, np.ndarray]:
+    """
+    Population per (region, year, sex, age) in thousands, for the (region, year) pairs in all three tables
+
+    Pregnant women are the births of that age in the coming year, where 9 year olds are extrapolated from
+    10 year olds. Breastfeeding women are the births of the two previous ages, i.e. mothers of children under 2.
+    Both are subtracted from the female population of their age.
+
+    :param female_df: UN population forecast by single age of women, in thousands
+    :param male_df: UN population forecast by single age of men, in thousands
+    :param birth_rate_df: UN birth rate by single age per 1000 women. Rows with missing rates are left out
+    :return: The (region, year) pairs, in the order of the female table, and the population with shape
+             (regions, years, sexes, ages). Region-year pairs that are not in all tables are 0
+    """
+
+    keys = population_keys(female_df, male_df, birth_rate_df)
+    female = single_age_array(female_df, keys)
+    male = single_age_array(male_df, keys)
+    births = female * single_age_array(birth_rate_df, keys) / 1000  # Thousands of births
+
+    pregnant = births.copy()
+    pregnant[:, 9] = births[:, 10]
+    breastfeeding = np.zeros_like(births)
+    breastfeeding[:, 1:] += births[:, :-1]
+    breastfeeding[:, 2:] += births[:, :-2]
+
+    regions, years, region_rows, year_rows = grid_positions(keys)
+    population = np.zeros((len(regions), len(years), len(SEXES), len(AGES)))
+    population[region_rows, year_rows] = np.stack([male, female - pregnant - breastfeeding, pregnant, breastfeeding],
+                                                  axis=1)
+    return keys, population
+
+
+def requirements_matrix(groups_df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """
+    Convert the daily requirements per group of GROUPS~1.CSV into matrices
+
+    :param groups_df: One row per group with the Age range, Gender and Breastfeeding/Pregnant condition,
+                      followed by the daily requirement per person of every nutrient.
+                      Non-numeric requirements are 0
+    :return: The aggregation matrix with shape (groups, sexes x ages), which is 1 for the sex and ages of a group,
+             the requirements matrix with shape (groups, nutrients), and the nutrient names
+    """
+
+    nutrients = list(groups_df.columns[3:])
+    requirements = groups_df[nutrients].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    aggregation = np.zeros((len(groups_df), len(SEXES), len(AGES)))
+    for group, (age_range, gender, condition) in enumerate(groups_df.iloc[:, :3].itertuples(index=False)):
+        sex = condition if condition in SEXES else gender
+        first, last = parse_age_range(str(age_range))
+        aggregation[group, SEXES.index(sex), first:last + 1] = 1
+    return aggregation.reshape(len(groups_df), -1), requirements, nutrients
+
+
+def compute_nutrient_requirements(female_df: pd.DataFrame, male_df: pd.DataFrame, birth_rate_df: pd.DataFrame,
+                                  groups_df: pd.DataFrame, column_mapping: dict[str, str] = None,
+                                  block_size: int = 256) -> pd.DataFrame:
+    """
+    Compute the total daily nutrient needs of every region and year (result_sum_adj_df)
+
+    The population array is multiplied once with the (sexes x ages, nutrients) matrix that combines the
+    aggregation and requirements matrices, for blocks of `block_size` regions at a time.
+
+    :param female_df: UN population forecast by single age of women, see population_array
+    :param male_df: UN population forecast by single age of men, see population_array
+    :param birth_rate_df: UN birth rate by single age per 1000 women, see population_array
+    :param groups_df: Daily requirements per person of every group, see requirements_matrix
+    :param column_mapping: Nutrients to keep and their column names. If None, COLUMN_MAPPING is used
+    :return: One row per region and year, with the total daily needs of every nutrient
+    """
+
+    column_mapping = column_mapping or COLUMN_MAPPING
+    keys, population = population_array(female_df, male_df, birth_rate_df)
+    aggregation, requirements, nutrients = requirements_matrix(groups_df)
+    nutrient_columns = [nutrients.index(nutrient) for nutrient in column_mapping]
+
+    # Population is in thousands, the requirements are per person
+    needs_per_person = aggregation.T @ requirements[:, nutrient_columns] * 1000
+    num_regions, num_years = population.shape[:2]
+    needs = np.empty((num_regions, num_years, len(nutrient_columns)))
+    for start in range(0, num_regions, block_size):
+        block = population[start:start + block_size]
+        needs[start:start + block_size] = (block.reshape(-1, needs_per_person.shape[0]) @ needs_per_person).reshape(
+            len(block), num_years, -1)
+
+    _, _, region_rows, year_rows = grid_positions(keys)
+    return pd.concat([
+        keys.to_frame(index=False),
+        pd.DataFrame(needs[region_rows, year_rows], columns=list(column_mapping.values())),
+    ], axis=1)
+
+
+def table_fingerprints(df: pd.DataFrame) -> tuple[str, dict[str, str]]:
+    """
+    SHA-256 hashes of a population table as a whole and of the rows of every region, to detect changes
+
+    :return: The hash of the table and the hash per region
+    """
+
+    columns = json.dumps([str(column) for column in df.columns]).encode('utf-8')
+    row_hashes = pd.Series(pd.util.hash_pandas_object(df, index=False).to_numpy(), index=df[REGION_COLUMN].to_numpy())
+    region_fingerprints = {
+        str(region): hashlib.sha256(columns + hashes.to_numpy().tobytes()).hexdigest()
+        for region, hashes in row_hashes.groupby(level=0, sort=False)
+    }
+    return hashlib.sha256(columns + row_hashes.to_numpy().tobytes()).hexdigest(), region_fingerprints
+
+
+def update_nutrient_requirements(female_df: pd.DataFrame, male_df: pd.DataFrame, birth_rate_df: pd.DataFrame,
+                                 groups_df: pd.DataFrame, column_mapping: dict[str, str] = None,
+                                 nutrient_needs_csv: str = NUTRIENT_NEEDS_CSV,
+                                 state_dir: str = NUTRIENT_NEEDS_STATE_DIR) -> pd.DataFrame:
+    """
+    Write the total daily nutrient needs of every region and year to a CSV file, like compute_nutrient_requirements,
+    but recompute only what depends on the inputs that changed since the previous run
+
+    The state directory keeps a manifest with the hashes of the input tables and of every region, the requirements
+    of the previous run, and the population per (region, year) and group of GROUPS~1.CSV. The needs are linear in
+    both, so:
+    - if the requirements of some nutrients changed, only their columns are recomputed from the group population
+    - if the population tables changed, only the rows of the regions whose rows changed are recomputed
+    Everything is recomputed if there is no state yet, or if the groups or the nutrient columns have changed.
+
+    :param nutrient_needs_csv: Path of the CSV file to write
+    :param state_dir: Directory of the state of the previous run
+    :return: One row per region and year, with the total daily needs of every nutrient
+    """
+
+    column_mapping = column_mapping or COLUMN_MAPPING
+    aggregation, requirements, nutrients = requirements_matrix(groups_df)
+    requirements = requirements[:, [nutrients.index(nutrient) for nutrient in column_mapping]]
+    groups = groups_df.iloc[:, :3].astype(str).to_numpy().tolist()
+
+    tables, regions = {}, {}
+    for name, df in [('female', female_df), ('male', male_df), ('birth_rate', birth_rate_df)]:
+        tables[name], region_fingerprints = table_fingerprints(df)
+        for region, fingerprint in region_fingerprints.items():
+            regions.setdefault(region, {})[name] = fingerprint
+    manifest = {'column_mapping': column_mapping, 'groups': groups, 'requirements': requirements.tolist(),
+                'tables': tables, 'regions': regions}
+
+    manifest_path = os.path.join(state_dir, 'manifest.json')
+    group_population_path = os.path.join(state_dir, 'group_population.npy')
+    needs_path = os.path.join(state_dir, 'needs.npy')
+    previous = None
+    if all(os.path.exists(path) for path in [manifest_path, group_population_path, needs_path, nutrient_needs_csv]):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous['column_mapping'] != column_mapping or previous['groups'] != groups:
+            previous = None
+
+    keys = population_keys(female_df, male_df, birth_rate_df)
+    key_regions = keys.get_level_values(0).astype(str)
+    if previous is None:
+        changed_regions = set(regions)
+        group_population = np.zeros((len(keys), len(groups)))
+        needs = np.zeros((len(keys), len(column_mapping)))
+    else:
+        # Reuse the rows of the unchanged regions. Their (region, year) pairs are the same as in the previous run
+        changed_regions = set() if previous['tables'] == tables else {
+            region for region in regions if previous['regions'].get(region) != regions[region]}
+        previous_keys = pd.MultiIndex.from_tuples([tuple(key) for key in previous['keys']])
+        previous_rows = previous_keys.get_indexer(keys)
+        group_population = np.load(group_population_path)[previous_rows]
+        needs = np.load(needs_path)[previous_rows]
+
+        # Patch the nutrient columns whose requirements changed
+        changed_columns = np.flatnonzero((np.array(previous['requirements']) != requirements).any(axis=0))
+        if len(changed_columns):
+            needs[:, changed_columns] = group_population @ requirements[:, changed_columns] * 1000
+
+    # Recompute the rows of the new or changed regions
+    changed_rows = np.flatnonzero(key_regions.isin(changed_regions))
+    if len(changed_rows):
+        changed_dfs = [df[df[REGION_COLUMN].astype(str).isin(changed_regions)]
+                       for df in [female_df, male_df, birth_rate_df]]
+        changed_keys, population = population_array(*changed_dfs)
+        _, _, region_rows, year_rows = grid_positions(changed_keys)
+        changed_group_population = population[region_rows, year_rows].reshape(len(changed_keys), -1) @ aggregation.T
+        rows = changed_keys.get_indexer(keys[changed_rows])
+        group_population[changed_rows] = changed_group_population[rows]
+        needs[changed_rows] = changed_group_population[rows] @ requirements * 1000
+
+    os.makedirs(state_dir, exist_ok=True)
+    np.save(group_population_path, group_population)
+    np.save(needs_path, needs)
+    manifest['keys'] = [[str(region), int(year)] for region, year in keys]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    nutrient_needs = pd.concat([
+        keys.to_frame(index=False),
+        pd.DataFrame(needs, columns=list(column_mapping.values())),
+    ], axis=1)
+    nutrient_needs.to_csv(nutrient_needs_csv, index=False)
+
+    nr_changed_regions = len(set(key_regions[changed_rows]))
+    print(f'Successfully written {len(nutrient_needs)} rows of nutrient needs to {nutrient_needs_csv}: '
+          f'{nr_changed_regions} regions recomputed')
+    return nutrient_needs
+
+
+if __name__ == '__main__':
+    update_nutrient_requirements(
+        pd.read_csv(FEMALE_POPULATION_URL),
+        pd.read_csv(MALE_POPULATION_URL),
+        pd.read_csv(BIRTH_RATE_URL, low_memory=False),
+        pd.read_csv(GROUPS_CSV),
+    )
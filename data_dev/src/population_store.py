@@ -0,0 +1,202 @@
+import json
+import os.path
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_DIR, REPO_DATA_DIR, file_fingerprint
+from nutrient_requirements import AGE_COLUMNS, REGION_COLUMN
+
+POPULATION_CSV = os.path.join(REPO_DATA_DIR, 'UN_PPP2024_Output_PopTot.csv')
+POPULATION_STORE_DIR = os.path.join(DATA_DIR, 'population', 'pop_tot')
+UN_API_POPULATION_STORE_DIR = os.path.join(DATA_DIR, 'population', 'un_api')
+
+POPULATION_REGION_COLUMN = 'Region, subregion, country or area *'
+LOCATION_CODE_COLUMN = 'Location code'
+
+ARRAY_NAMES = ['population', 'location_codes']
+
+
+class PopulationStore:
+    """
+    UN population projections as a float64 (regions x years) array, or (regions x years x ages) for the forecasts
+    by single age, in thousands
+
+    The array is usually a read-only memory map of the files written by `save_population_store`, so loading it
+    only parses the (small) JSON header. Rows are in the order of the source table. Region names can occur more
+    than once (e.g. 'Latin America and the Caribbean' as an SDG region and as a continent), in which case the
+    first row is used for the name and the location code tells the rows apart. Location codes are -1 if unknown.
+    """
+
+    def __init__(self, header: dict, arrays: dict[str, np.ndarray]):
+        self.header = header
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    @property
+    def regions(self) -> list[str]:
+        return self.header['regions']
+
+    @property
+    def years(self) -> list[int]:
+        return self.header['years']
+
+    @property
+    def ages(self) -> list[str] | None:
+        return self.header['ages']
+
+    @cached_property
+    def region_index(self) -> dict[str, int]:
+        """
+        Row index per region name. For duplicated names, the first row is used
+        """
+
+        region_index = {}
+        for row, region in enumerate(self.regions):
+            region_index.setdefault(region, row)
+        return region_index
+
+    @cached_property
+    def location_index(self) -> dict[int, int]:
+        """
+        Row index per location code
+        """
+
+        return {int(location_code): row for row, location_code in enumerate(self.location_codes) if location_code >= 0}
+
+    @cached_property
+    def year_index(self) -> dict[int, int]:
+        """
+        Column index per year
+        """
+
+        return {year: column for column, year in enumerate(self.years)}
+
+    def get(self, region: str, year: int, default=None):
+        """
+        Population of a region (name or location code) in a year, or the default if either is not in the store.
+        For the forecasts by single age, this is an array with the population per age
+        """
+
+        index = self.location_index if isinstance(region, (int, np.integer)) else self.region_index
+        row, column = index.get(region), self.year_index.get(int(year))
+        if row is None or column is None:
+            return default
+        return self.population[row, column]
+
+    def __getitem__(self, key: tuple[str, int]):
+        region, year = key
+        value = self.get(region, year)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+
+def build_population_store(population_df: pd.DataFrame, region_column: str = POPULATION_REGION_COLUMN,
+                           source: dict = None) -> PopulationStore:
+    """
+    Convert a table with one row per region and one column per year, like UN_PPP2024_Output_PopTot.csv,
+    into a population store. Rows without a region name and columns that are not years are left out,
+    and missing values are NaN
+
+    :param population_df: Population projections with the region name, optionally the location code,
+                          and the population per year
+    :param region_column: Name of the region column
+    :param source: Fingerprint of the file the table was read from, to detect a stale store
+    """
+
+    population_df = population_df.dropna(subset=[region_column])
+    year_columns = [column for column in population_df.columns if str(column).isdigit()]
+    population = population_df[year_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+    header = {'regions': population_df[region_column].astype(str).tolist(),
+              'years': [int(column) for column in year_columns], 'ages': None, 'source': source}
+    return PopulationStore(header, {'population': population, 'location_codes': _location_codes(population_df)})
+
+
+def build_single_age_population_store(population_df: pd.DataFrame, region_column: str = REGION_COLUMN,
+                                      source: dict = None) -> PopulationStore:
+    """
+    Convert a table with one row per region and year and one column per single age, like the UN forecasts
+    by single age of nutrient_requirements, into a (regions x years x ages) population store.
+    Missing values, and the years that a region is not in the table, are NaN
+
+    :param population_df: Population forecasts with the region name, the year, optionally the location code,
+                          and the population per age ('0' to '99' and '100+')
+    :param region_column: Name of the region column
+    :param source: Fingerprint of the file the table was read from, to detect a stale store
+    """
+
+    population_df = population_df.dropna(subset=[region_column])
+    population_df = population_df[~population_df.duplicated([region_column, 'Year'])]
+    regions = population_df[region_column].astype(str).drop_duplicates()
+    years = np.sort(population_df['Year'].astype(int).unique())
+
+    population = np.full((len(regions), len(years), len(AGE_COLUMNS)), np.nan)
+    region_rows = pd.Index(regions).get_indexer(population_df[region_column].astype(str))
+    year_columns = years.searchsorted(population_df['Year'].astype(int))
+    population[region_rows, year_columns] = population_df.reindex(columns=AGE_COLUMNS).apply(
+        pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+    header = {'regions': regions.tolist(), 'years': years.tolist(), 'ages': AGE_COLUMNS, 'source': source}
+    location_codes = _location_codes(population_df.loc[regions.index])
+    return PopulationStore(header, {'population': population, 'location_codes': location_codes})
+
+
+def _location_codes(population_df: pd.DataFrame) -> np.ndarray:
+    if LOCATION_CODE_COLUMN not in population_df.columns:
+        return np.full(len(population_df), -1, dtype=np.int64)
+    location_codes = pd.to_numeric(population_df[LOCATION_CODE_COLUMN], errors='coerce')
+    return location_codes.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def save_population_store(store: PopulationStore, path: str = POPULATION_STORE_DIR) -> str:
+    """
+    Write a population store to a directory, with one .npy file per array and the header in a JSON file
+
+    :return: Path to the directory
+    """
+
+    os.makedirs(path, exist_ok=True)
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(path, f'{name}.npy'), getattr(store, name))
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(store.header, f)
+    return path
+
+
+def load_population_store(path: str = POPULATION_STORE_DIR) -> PopulationStore:
+    """
+    Load a population store written by save_population_store, with the arrays as read-only memory maps
+    """
+
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+    return PopulationStore(header, arrays)
+
+
+def get_population_store(path: str = POPULATION_STORE_DIR, csv_path: str = POPULATION_CSV) -> PopulationStore:
+    """
+    Load the population store of UN_PPP2024_Output_PopTot.csv, building it first if it does not exist yet
+    or if the CSV file has changed since it was built. The store downloaded from the UN Population API
+    (see UnPopulation.update_population_store) is kept separately in UN_API_POPULATION_STORE_DIR,
+    and is loaded with load_population_store
+    """
+
+    source = file_fingerprint(csv_path)
+    if os.path.exists(os.path.join(path, 'header.json')):
+        store = load_population_store(path)
+        if store.header['source'] == source:
+            return store
+
+    store = build_population_store(pd.read_csv(csv_path, encoding='ISO-8859-1'), source=source)
+    save_population_store(store, path)
+    print(f'Successfully written {len(store.regions)} regions x {len(store.years)} years of population to {path}')
+    return load_population_store(path)
+
+
+if __name__ == '__main__':
+    population_store = get_population_store()
+    print(f'Population of the World in 2050: {population_store.get("World", 2050)} thousand')
@@ -1,7 +1,46 @@
-import requests
+import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
+from itertools import islice
+from typing import Generator, Iterable, TypedDict
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from common import DATA_DIR, JSON, get_secret
+from fdc_cache import CachedApi, FileCache, ResponseCache
+from population_store import UN_API_POPULATION_STORE_DIR, PopulationStore, load_population_store, \
+    save_population_store
+
+UN_POPULATION_CACHE_DIR = os.path.join(DATA_DIR, 'un_population_cache')
+
+
+class PopulationRecordDict(TypedDict):
+    """
+    Example of a (shortened) data record of the UN Population API:
+    {
+        "locationId": 4,
+        "location": "Afghanistan",
+        "indicatorId": 49,
+        "variantId": 4,
+        "variant": "Median",
+        "timeLabel": "2030",
+        "sexId": 3,
+        "sex": "Both sexes",
+        "ageLabel": "Total",
+        "value": 50330837.0
+    }
+    """
 
-from common import JSON, get_secret
+    locationId: int
+    location: str
+    indicatorId: int
+    variantId: int
+    timeLabel: str
+    sexId: int
+    value: float
 
 
 class UnPopulation:
@@ -21,32 +60,218 @@ class UnPopulation:
         "UN_POPULATION_API_KEY": "API_KEY_HERE",
     }
     If you do not have an API key, you cannot use the API.
+
+    Pagination
+
+    The API returns the results in pages of at most `PAGE_SIZE` items, with the total number of pages in every page.
+    The first page of a call tells how many pages there are, after which its remaining pages are fetched.
+
+    Cache
+
+    Like for FoodDataCentral, the responses of GET calls are cached as one JSON file per URL in the
+    `data/un_population_cache` directory, or in any other `fdc_cache.ResponseCache`, with the same URLs and keys
+    (see fdc_cache.CachedApi). The last `memory_cache_size` first pages that were used are kept in memory,
+    while the remaining pages are only read once and bypass the memory cache. Cached responses never expire:
+    to get a new revision of the projections, clear the cache.
+
+    Concurrency
+
+    All requests go through one pooled HTTP session. With `max_workers` > 1, the calls for multiple
+    indicators and locations and their pages are fetched concurrently by a pool of threads,
+    while still being yielded in order. At most `max_workers` first pages and `max_workers` other pages
+    are requested ahead of the page that is being yielded.
     """
 
     BASE_URL = 'https://population.un.org/dataportalapi'
+    CACHE_DIR = UN_POPULATION_CACHE_DIR
+    PAGE_SIZE = 100
+    MAX_LOCATIONS_PER_CALL = 20
+
+    TOTAL_POPULATION_INDICATOR = 49  # Total population by sex
+    MEDIAN_VARIANT = 4
+    BOTH_SEXES = 3
+
+    def __init__(self, max_workers: int = 1, base_url: str = None, cache: ResponseCache = None,
+                 memory_cache_size: int = 64, api_key: str = None):
+        """
+        :param max_workers: Number of calls and pages that are fetched concurrently
+        :param base_url: Base URL of the API, e.g. to use a local stub server instead of the real API
+        :param cache: Store of the cached responses. If None, one JSON file per response in CACHE_DIR is used
+        :param memory_cache_size: Number of responses to keep in memory in front of the cache. If 0, none are kept
+        :param api_key: API key. If None, it is read from the secrets file
+        """
+
+        self.max_workers = max_workers
+        self.api = CachedApi(base_url or self.BASE_URL, cache or FileCache(self.CACHE_DIR),
+                             memory_cache_size=memory_cache_size)
+        self._api_key = api_key
+
+        # HTTP session with a connection pool that is large enough for all workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_workers, 10))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     @cached_property
     def headers(self):
-        api_key = get_secret('UN_POPULATION_API_KEY')
+        api_key = self._api_key or get_secret('UN_POPULATION_API_KEY')
         return {
             'Authorization': f'Bearer {api_key}'
         }
 
-    def get_indicators(self):
-        url = f'{self.BASE_URL}/api/v1/indicators'
-        return self._make_get_call(url)
+    def get_indicators(self) -> list[JSON]:
+        url = 'api/v1/indicators'
+        return list(self._make_paginated_get_calls([url]))
+
+    def get_locations(self) -> list[JSON]:
+        url = 'api/v1/locations'
+        return list(self._make_paginated_get_calls([url]))
+
+    def get_population_projection(self, location_ids: list[int], start_year: int, end_year: int,
+                                  indicator_ids: list[int] = None, variant_id: int = MEDIAN_VARIANT,
+                                  sex_id: int = BOTH_SEXES) -> Generator[PopulationRecordDict, None, None]:
+        """
+        Get an iterator over the projected values of the given indicators, locations and years
+
+        :param location_ids: Location codes of the regions, e.g. 4 for Afghanistan and 900 for the World
+        :param start_year: First year (inclusive)
+        :param end_year: Last year (inclusive)
+        :param indicator_ids: Indicators you are interested in. If None, the total population is returned
+        :param variant_id: Projection variant, the median by default
+        :param sex_id: Sex, both sexes by default
+        :return: Generator over all data records, per indicator and location
+        """
+
+        indicator_ids = indicator_ids or [self.TOTAL_POPULATION_INDICATOR]
+        urls = [
+            f'api/v1/data/indicators/{indicator_id}/locations/{",".join(str(location_id) for location_id in batch)}'
+            f'/start/{start_year}/end/{end_year}'
+            for indicator_id in indicator_ids
+            for batch in [location_ids[start:start + self.MAX_LOCATIONS_PER_CALL]
+                          for start in range(0, len(location_ids), self.MAX_LOCATIONS_PER_CALL)]
+        ]
+        yield from self._make_paginated_get_calls(urls, {'variants': variant_id, 'sexes': sex_id})
+
+    def update_population_store(self, location_ids: list[int] = None, start_year: int = 2024, end_year: int = 2100,
+                                path: str = UN_API_POPULATION_STORE_DIR) -> PopulationStore:
+        """
+        Download the total population projections into a population store, like get_population_store builds
+        from UN_PPP2024_Output_PopTot.csv. It is written to its own directory, so it does not replace the store
+        of the CSV file, whose region names match result_sum_adj_df.csv. The records are written into the
+        (regions x years) array while they are streamed, and values that are not returned are NaN. The API returns
+        numbers of people, which are stored in thousands like in the UN CSV files. Records of locations or years
+        that were not requested are skipped
+
+        :param location_ids: Location codes of the regions. If None, all locations of the API are used
+        :param start_year: First year (inclusive)
+        :param end_year: Last year (inclusive)
+        :param path: Directory of the population store
+        """
+
+        locations = {location['id']: location['name'] for location in self.get_locations()}
+        location_ids = location_ids or list(locations)
+        rows = {location_id: row for row, location_id in enumerate(location_ids)}
+        years = list(range(start_year, end_year + 1))
+
+        population = np.full((len(location_ids), len(years)), np.nan)
+        for record in self.get_population_projection(location_ids, start_year, end_year):
+            # Skip records of locations that were not requested, e.g. aggregates that the API adds
+            row = rows.get(record['locationId'])
+            year = int(record['timeLabel'])
+            if row is not None and start_year <= year <= end_year:
+                population[row, year - start_year] = record['value'] / 1000
+
+        header = {
+            'regions': [locations.get(location_id, str(location_id)) for location_id in location_ids],
+            'years': years,
+            'ages': None,
+            'source': {'url': self.api.base_url, 'indicator': self.TOTAL_POPULATION_INDICATOR,
+                       'variant': self.MEDIAN_VARIANT},
+        }
+        store = PopulationStore(header, {'population': population,
+                                         'location_codes': np.array(location_ids, dtype=np.int64)})
+        save_population_store(store, path)
+        print(f'Successfully written {len(location_ids)} regions x {len(years)} years of population to {path}')
+        return load_population_store(path)
+
+    def _make_paginated_get_calls(self, urls: Iterable[str], params: dict = None) -> Generator[JSON, None, None]:
+        """
+        Make paginated GET calls to the API. The first pages of the next calls are fetched while the remaining pages
+        of the current call are fetched, with at most `max_workers` of each requested ahead
+
+        :param urls: URLs to make the GET calls to
+        :param params: Parameters to pass in every GET call
+        :return: Generator over all items in the paginated responses, in the order of the URLs and pages
+        """
+
+        params = {**(params or {}), 'pageSize': self.PAGE_SIZE}
+        urls = iter(urls)
+        first_pages = deque()  # Futures of the requested first pages, in the order of the URLs
+        other_pages = deque()  # Futures of the requested other pages of the current call, in page order
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                for url in islice(urls, self.max_workers - len(first_pages)):
+                    first_pages.append((url, executor.submit(self._make_get_call, url, {**params, 'pageNumber': 1})))
+                if not first_pages:
+                    break
+
+                url, future = first_pages.popleft()
+                first_page = future.result()
+                yield from self._page_items(first_page)
+
+                page_numbers = iter(range(2, self._number_of_pages(first_page) + 1))
+                while True:
+                    for page_number in islice(page_numbers, self.max_workers - len(other_pages)):
+                        other_pages.append(executor.submit(self._make_get_call, url,
+                                                           {**params, 'pageNumber': page_number}, False))
+                    if not other_pages:
+                        break
+                    yield from self._page_items(other_pages.popleft().result())
+        finally:
+            for future in [future for _, future in first_pages] + list(other_pages):
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def _number_of_pages(page: JSON) -> int:
+        return page.get('pages', 1) if isinstance(page, dict) else 1
+
+    @staticmethod
+    def _page_items(page: JSON) -> list[JSON]:
+        """
+        Items of a page, which is either a list or a dictionary with the items in `data`
+        """
+
+        items = page.get('data', []) if isinstance(page, dict) else page
+        # Verify that the returned data is indeed a list to yield from
+        if not isinstance(items, list):
+            raise ValueError(f'Expected a list, but got {type(items)}')
+        return items
+
+    def _make_get_call(self, url: str, params: dict = None, use_memory_cache: bool = True) -> JSON:
+        """
+        Make a GET call to the API, or get its response from the cache
+
+        :param url: URL to make the GET call to, relative to the base URL
+        :param params: Parameters to pass in the GET call
+        :param use_memory_cache: Whether the cached response may be kept in memory, see CachedApi.get_cache_entry
+        """
 
-    def get_population_projection(self):
-        url = f'{self.BASE_URL}/api/v1/empirical/data'
+        url = self.api.build_url(url, params)
+        entry = self.api.get_cache_entry(url, use_memory_cache)
+        if entry is not None:
+            return entry['data']
 
-    def _make_get_call(self, url: str, params: dict = None) -> JSON:
-        params = params or {}
-        response = requests.get(url, params=params, headers=self.headers)
+        response = self.session.get(url, headers=self.headers)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        self.api.add_response_to_cache(url, data, response.headers)
+        print(f'Added response from {url} to cache')
+        return data
 
 
 if __name__ == '__main__':
-    un_population = UnPopulation()
+    un_population = UnPopulation(max_workers=8)
     print(un_population.get_indicators())
-    # print(un_population.get_population_projection())
+    un_population.update_population_store()
@@ -0,0 +1,136 @@
+import json
+import math
+import os.path
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Make the modules in data_dev/src importable
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fdc import FoodDataCentral
+from fdc_cache import FileCache
+from un_population import UnPopulation
+
+NUMBER_OF_FOODS = 235
+YEARS = range(2030, 2041)
+
+
+def make_food(fdc_id: int) -> dict:
+    return {'fdcId': fdc_id, 'description': f'Food {fdc_id}', 'dataType': 'SR Legacy', 'foodNutrients': []}
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stub of the FDC API (under /fdc) and the UN Population API (under /un).
+    Odd pages are answered later than even pages, so concurrent pages complete out of order
+    """
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page_number, page_size = int(params.get('pageNumber', 1)), int(params.get('pageSize', 50))
+        self.requests.append(('GET', url.path, page_number))
+        time.sleep(0.02 if page_number % 2 else 0)
+
+        if url.path == '/fdc/v1/foods/list':
+            fdc_ids = range((page_number - 1) * page_size, min(page_number * page_size, NUMBER_OF_FOODS))
+            return self._send([make_food(fdc_id) for fdc_id in fdc_ids])
+        if url.path.startswith('/un/api/v1/data/'):
+            parts = url.path.split('/')
+            location_ids = [int(location_id) for location_id in parts[parts.index('locations') + 1].split(',')]
+            records = [{'locationId': location_id, 'timeLabel': str(year), 'value': location_id * 10000 + year}
+                       for location_id in location_ids for year in YEARS]
+            return self._send({'pages': math.ceil(len(records) / page_size),
+                               'data': records[(page_number - 1) * page_size:page_number * page_size]})
+        self._send({'error': 'Not found'}, status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(('POST', url.path, body['fdcIds']))
+        if url.path == '/fdc/v1/foods':
+            return self._send([make_food(fdc_id) for fdc_id in body['fdcIds']])
+        self._send({'error': 'Not found'}, status=404)
+
+    def _send(self, data, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubApiTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubApiHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubApiHandler.requests.clear()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+
+class TestFoodDataCentral(StubApiTestCase):
+    def test_food_list_yields_pages_in_order(self):
+        for max_workers in [1, 4]:
+            with self.subTest(max_workers=max_workers):
+                fdc = FoodDataCentral(max_workers=max_workers, base_url=f'{self.base_url}/fdc',
+                                      cache=FileCache(os.path.join(self.cache_dir, str(max_workers))))
+                fdc_ids = [food['fdcId'] for food in fdc.food_list()]
+                self.assertEqual(fdc_ids, list(range(NUMBER_OF_FOODS)))
+
+    def test_get_foods_batches_20_ids_per_call(self):
+        fdc = FoodDataCentral(base_url=f'{self.base_url}/fdc', cache=FileCache(self.cache_dir))
+        fdc_ids = list(range(1000, 1045))
+        foods = fdc.get_foods(fdc_ids)
+        self.assertEqual([food['fdcId'] for food in foods], fdc_ids)
+        self.assertEqual([fdc_ids[:20], fdc_ids[20:40], fdc_ids[40:]],
+                         [body for method, _, body in StubApiHandler.requests if method == 'POST'])
+
+        # All food items are cached now, so only the new ones are requested
+        StubApiHandler.requests.clear()
+        fdc.get_foods(fdc_ids + [2000])
+        self.assertEqual([('POST', '/fdc/v1/foods', [2000])], StubApiHandler.requests)
+
+
+class TestUnPopulation(StubApiTestCase):
+    def test_population_projection_yields_pages_in_order(self):
+        location_ids = list(range(1, 46))
+        expected = [(location_id, str(year)) for location_id in location_ids for year in YEARS]
+        for max_workers in [1, 4]:
+            with self.subTest(max_workers=max_workers):
+                StubApiHandler.requests.clear()
+                un_population = UnPopulation(max_workers=max_workers, base_url=f'{self.base_url}/un',
+                                             cache=FileCache(os.path.join(self.cache_dir, str(max_workers))),
+                                             api_key='test')
+                records = un_population.get_population_projection(location_ids, YEARS[0], YEARS[-1])
+                self.assertEqual([(record['locationId'], record['timeLabel']) for record in records], expected)
+
+                # One call per 20 locations, with 3 pages of 100 records for the full batches
+                batches = {path.split('/locations/')[1].split('/')[0] for _, path, _ in StubApiHandler.requests}
+                self.assertEqual(sorted(len(batch.split(',')) for batch in batches), [5, 20, 20])
+                self.assertEqual(len(StubApiHandler.requests), 3 + 3 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
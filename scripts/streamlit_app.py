@@ -1,17 +1,60 @@
+import os.path
+import sys
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 
-results = "https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/data/result_sum_adj_df.csv"
-
-food_data = "https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/data/WAFCT2019%2BPULSES.csv"
+# Make the modules in data_dev/src importable
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_dev', 'src'))
 
-populationstat = "https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/data/UN_PPP2024_Output_PopTot.csv"
+from diet_solver import solve_diet
+from food_composition import get_food_composition
+from meal_plan import FOOD_GROUP_LIMITS, NUTRIENT_COLUMNS
+from population_store import get_population_store
 
-# Load the CSV files
-nutrient_needs_df = pd.read_csv(results)
-food_data_df = pd.read_csv(food_data)
-population_df = pd.read_csv(populationstat, encoding='ISO-8859-1')
+results = "https://raw.githubusercontent.com/kocsigabor99/MAJOR-CROPS-FAODATA/refs/heads/main/data/result_sum_adj_df.csv"
+results_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'result_sum_adj_df.csv')
+
+# Load the data once per server process instead of on every rerun: the nutrient needs (from the local CSV file
+# if it exists), the precompiled food composition matrix (built from WAFCT2019+PULSES.csv)
+# and the population store (built from UN_PPP2024_Output_PopTot.csv)
+@st.cache_data
+def load_nutrient_needs():
+    return pd.read_csv(results_csv if os.path.exists(results_csv) else results)
+
+@st.cache_resource
+def load_food_composition():
+    return get_food_composition()
+
+@st.cache_resource
+def load_population_store():
+    return get_population_store()
+
+# Function to compute the population and the per capita daily needs of every (country, year) at once
+@st.cache_data
+def load_per_capita_needs():
+    """
+    Return the population per row of the nutrient needs table, the per capita needs as a table with the same rows
+    and columns, and the row index per (country, year)
+    """
+    nutrient_needs_df = load_nutrient_needs()
+    population_store = load_population_store()
+    keys = list(zip(nutrient_needs_df['Region, subregion, country or area'], nutrient_needs_df['Year']))
+    # Default to 1 if data is missing
+    population = np.array([population_store.get(country, year, default=1) for country, year in keys], dtype=float)
+
+    per_capita_needs_df = nutrient_needs_df.copy()
+    numeric_columns = per_capita_needs_df.select_dtypes(include=['float64', 'int64']).columns.drop('Year', errors='ignore')
+    per_capita_needs_df[numeric_columns] = per_capita_needs_df[numeric_columns].div(population, axis=0)
+    row_index = {}
+    for row, key in enumerate(keys):
+        row_index.setdefault(key, row)  # For duplicated rows, the first row is used
+    return population, per_capita_needs_df, row_index
+
+nutrient_needs_df = load_nutrient_needs()
+food_composition = load_food_composition()
+population_per_row, per_capita_needs_df, row_index = load_per_capita_needs()
 
 # User interface for selecting country and year
 st.title('National Nutrient-Based Meal Planner')
@@ -20,18 +63,12 @@ st.title('National Nutrient-Based Meal Planner')
 country = st.selectbox('Select Country', nutrient_needs_df['Region, subregion, country or area'].unique())
 year = st.selectbox('Select Year', nutrient_needs_df['Year'].unique())
 
-# Filter nutrient needs for the selected country and year
-filtered_needs = nutrient_needs_df[(nutrient_needs_df['Region, subregion, country or area'] == country) & 
-                                   (nutrient_needs_df['Year'] == year)]
-
-# Retrieve population for the selected country and year
-population_row = population_df[(population_df['Region, subregion, country or area *'] == country)]
-population = population_row[str(year)].values[0] if not population_row.empty else 1  # Default to 1 if data is missing
-
-# Calculate daily nutrient needs per citizen
-daily_needs_per_citizen = filtered_needs.copy()
-numeric_columns = daily_needs_per_citizen.select_dtypes(include=['float64', 'int64']).columns
-daily_needs_per_citizen[numeric_columns] /= population
+# Look up the nutrient needs, the population and the needs per citizen for the selected country and year
+row = row_index.get((country, year))
+rows = [] if row is None else [row]
+filtered_needs = nutrient_needs_df.iloc[rows]
+population = population_per_row[row] if row is not None else 1
+daily_needs_per_citizen = per_capita_needs_df.iloc[rows]
 
 # Display the total nutrient needs for the country
 st.subheader(f'Total Nutrient Needs for {country} in {year} for a day (Countrywide)')
@@ -42,30 +79,45 @@ st.subheader(f'Per Capita Average Daily Nutrient Needs for {country} in {year}')
 st.write(daily_needs_per_citizen)
 
 # Define food group calorie limits for daily intake
-food_group_calorie_limits = {
-    "DAIRY": 250,
-    "MEAT": 56,
-    "FISH": 28,
-    "FATS AND OILS": 40,
-    "GRAINS": 250,
-    "STARCHY ROOTS/TUBERS": 100,
-    "LEGUMES SOAKED & BOILED & DRAINED": 75,
-    "VEGETABLES": 400,
-    "FRUITS": 200,
-    "NUTS": 50
-}
-
-# Set maximum foods and attempts
-max_foods = 30
-max_attempts = 50
+food_group_calorie_limits = FOOD_GROUP_LIMITS
 
-# Helper function to clean nutrient values
-def clean_nutrient_value(value):
-    try:
-        value = str(value).replace('[', '').replace(']', '').strip()
-        return float(value)
-    except ValueError:
-        return 0.0
+# Set maximum foods, attempts and random seed
+max_foods = 30
+max_attempts = 10_000
+seed = 42
+
+# Nutrient needs taken into account when adding a food item to a meal plan, and their food composition column
+nutrient_columns = NUTRIENT_COLUMNS
+
+# Function to list the (food type, grams) slots every meal plan is filled with
+def build_meal_plan_slots(group_indices, max_foods, food_group_limits):
+    """
+    Each round, every food group that is still below its limit gets one food item of at most 50g,
+    until max_foods items have been added or all limits have been reached.
+    The slots are the same for every attempt: only the food item picked per slot is random.
+    """
+    slots = []
+    food_type_sums = {food_type: 0 for food_type in food_group_limits}
+    while len(slots) < max_foods:
+        food_was_added = False
+        for food_type, limit in food_group_limits.items():
+            if food_type_sums[food_type] < limit and len(group_indices[food_type]) > 0:
+                grams_to_add = min(limit - food_type_sums[food_type], 50)
+                slots.append((food_type, grams_to_add))
+                food_type_sums[food_type] += grams_to_add
+                food_was_added = True
+                if len(slots) >= max_foods:
+                    break
+        if not food_was_added:
+            break
+    return slots
+
+# Function to get the nutrients per 100g of every food item, in the order of the nutrient needs columns
+def build_needs_matrix(food_composition, needs_columns):
+    """
+    Return a (foods x needs_columns) matrix. Needs that are not in nutrient_columns stay 0
+    """
+    return food_composition.columns([nutrient_columns.get(nutrient) for nutrient in needs_columns])
 
 # Function to calculate percentage of nutrient needs met
 def calculate_percentage_met(nutrient_needs_df, total_nutrients):
@@ -78,100 +130,153 @@ def calculate_percentage_met(nutrient_needs_df, total_nutrients):
     return percentage_met
 
 # Function to generate optimized meal plans and select the best
-def generate_optimized_meal_plan(daily_needs_per_citizen, food_data, max_foods, max_attempts, population, total_needs):
-    best_iteration = None
-    best_coverage_score = float('-inf')  # Track best-fit score
-
-    all_iterations_results = []
+def generate_optimized_meal_plan(daily_needs_per_citizen, food_composition, max_foods, max_attempts, population, total_needs, seed=None, food_group_limits=None):
+    """
+    Draw max_attempts random meal plans at once and keep the one with the highest average coverage.
+    All food picks are drawn as one (attempts x slots) index tensor, and the nutrients of every plan
+    are computed with a single matrix multiplication. The results are reproducible for a given seed.
+    If food_group_limits is None, food_group_calorie_limits is used.
+    """
+    food_group_limits = food_group_limits or food_group_calorie_limits
+    rng = np.random.default_rng(seed)
+    needs_columns = list(daily_needs_per_citizen.columns[2:])
+    matrix = build_needs_matrix(food_composition, needs_columns)
+    food_names = food_composition.food_names
+    group_indices = food_composition.group_indices(food_group_limits)
+    slots = build_meal_plan_slots(group_indices, max_foods, food_group_limits)
+
+    # Draw the food item for every slot of every attempt: (attempts x slots) row indices into the matrix
+    slot_groups = [group_indices[food_type] for food_type, _ in slots]
+    group_sizes = np.array([len(rows) for rows in slot_groups])
+    group_offsets = np.concatenate([[0], np.cumsum(group_sizes)[:-1]]).astype(int)
+    slot_rows = np.concatenate(slot_groups) if slot_groups else np.zeros(0, dtype=int)
+    picks = np.floor(rng.random((max_attempts, len(slots))) * group_sizes).astype(int)
+    food_indices = slot_rows[group_offsets + picks]
+
+    # Nutrients per attempt: (slots,) @ (attempts x slots x nutrients) -> (attempts x nutrients)
+    slot_weights = np.array([grams / 100.0 for _, grams in slots], dtype=np.float32)
+    total_nutrients = (slot_weights @ matrix[food_indices]).astype(float)
+
+    # Calculate daily nutrient fulfillment and percentage per nutrient for every attempt at once
+    required_amounts = np.array([daily_needs_per_citizen[nutrient].values[0] for nutrient in needs_columns], dtype=float)
+    met_columns = np.flatnonzero(required_amounts > 0)
+    percentage_met = total_nutrients[:, met_columns] / required_amounts[met_columns] * 100
+    avg_coverage_scores = percentage_met.mean(axis=1)
+
+    # Keep the results of all attempts as arrays, with one row per attempt
+    all_iterations_results = {
+        "Food Indices": food_indices,
+        "Total Nutrients": total_nutrients,
+        "Percentage Fulfillment (%)": percentage_met,
+        "Average Coverage": avg_coverage_scores
+    }
 
-    for attempt in range(max_attempts):
+    # Select the best iteration based on the highest average coverage score, and only build its meal plan
+    best_iteration = None
+    if max_attempts > 0:
+        best = int(np.argmax(avg_coverage_scores))
         meal_plan = {}
-        total_nutrients = {nutrient: 0 for nutrient in daily_needs_per_citizen.columns[2:]}
-        food_type_sums = {food_type: 0 for food_type in food_group_calorie_limits}
-        total_foods_selected = 0
-
-        def add_food_item_to_plan(food_item, food_type, grams):
-            if food_type not in meal_plan:
-                meal_plan[food_type] = []
-            meal_plan[food_type].append({"Food": food_item['Food name in English'], "Grams": grams})
-
-            nutrient_values_per_100g = {
-                'Vitamin A (RAE, mcg)': clean_nutrient_value(food_item.get('Vitamin A (RAE, mcg)', 0)),
-                'Thiamine (vitamin B1) (mg)': clean_nutrient_value(food_item.get('Thiamine (vitamin B1) (mg)', 0)),
-                'Riboflavin (vitamin B2) (mg)': clean_nutrient_value(food_item.get('Riboflavin (vitamin B2) (mg)', 0)),
-                'Niacin equivalents or [niacin, preformed] (vitamin B3) (mg)': clean_nutrient_value(food_item.get('Niacin equivalents or [niacin, preformed] (vitamin B3) (mg)', 0)),
-                'Vitamin B6 (mg)': clean_nutrient_value(food_item.get('Vitamin B6 (mg)', 0)),
-                'Folate, total or [folate, sum of vitamers] (vitamin B9) (mcg)': clean_nutrient_value(food_item.get('Folate, total or [folate, sum of vitamers] (vitamin B9) (mcg)', 0)),
-                'Vitamin B12 (mcg)': clean_nutrient_value(food_item.get('Vitamin B12 (mcg)', 0)),
-                'Vitamin C (mg)': clean_nutrient_value(food_item.get('Vitamin C (mg)', 0)),
-                'Vitamin E (expressed in alpha-tocopherol equivalents) or [alpha-tocopherol] (mg)': clean_nutrient_value(food_item.get('Vitamin E (expressed in alpha-tocopherol equivalents) or [alpha-tocopherol] (mg)', 0)),
-                'Calcium (mg)': clean_nutrient_value(food_item.get('Calcium (mg)', 0)),
-                'Potassium (mg)': clean_nutrient_value(food_item.get('Potassium (mg)', 0)),
-                'Copper (mg)': clean_nutrient_value(food_item.get('Copper (mg)', 0)),
-                'Iron (mg)': clean_nutrient_value(food_item.get('Iron (mg)', 0)),
-                'Magnesium (mg)': clean_nutrient_value(food_item.get('Magnesium (mg)', 0)),
-                'Zinc (mg)': clean_nutrient_value(food_item.get('Zinc (mg)', 0))
-            }
-
-            for nutrient, value in nutrient_values_per_100g.items():
-                total_nutrients[nutrient] += value * (grams / 100.0)
-
-            if food_type in food_type_sums:
-                food_type_sums[food_type] += grams
-
-        while total_foods_selected < max_foods:
-            food_was_added = False
-
-            for food_type, limit in food_group_calorie_limits.items():
-                if food_type_sums[food_type] < limit:
-                    food_items = food_data[food_data['FOOD TYPE'] == food_type]
-                    if not food_items.empty:
-                        food_item = food_items.sample(n=1).iloc[0]
-                        grams_to_add = min(limit - food_type_sums[food_type], 50)
-
-                        if grams_to_add > 0:
-                            add_food_item_to_plan(food_item, food_type, grams_to_add)
-                            total_foods_selected += 1
-                            food_was_added = True
-                            if total_foods_selected >= max_foods:
-                                break
-
-            if not food_was_added:
-                break
-
-        # Calculate daily nutrient fulfillment and percentage per nutrient
-        daily_percentage_met = calculate_percentage_met(daily_needs_per_citizen, total_nutrients)
-        avg_coverage_score = sum(daily_percentage_met.values()) / len(daily_percentage_met)
-
-        all_iterations_results.append({
-            "Iteration": attempt + 1,
+        for (food_type, grams), food_index in zip(slots, food_indices[best]):
+            meal_plan.setdefault(food_type, []).append({"Food": food_names[food_index], "Grams": grams})
+        best_iteration = {
+            "Iteration": best + 1,
             "Meal Plan (grams per type)": meal_plan,
-            "Total Nutrients": total_nutrients,
-            "Percentage Fulfillment (%)": daily_percentage_met
-        })
+            "Total Nutrients": dict(zip(needs_columns, total_nutrients[best].tolist())),
+            "Percentage Fulfillment (%)": {needs_columns[i]: value for i, value in zip(met_columns, percentage_met[best].tolist())}
+        }
 
-        if avg_coverage_score > best_coverage_score:
-            best_coverage_score = avg_coverage_score
-            best_iteration = all_iterations_results[-1]
+    final_scaled_plan = {
+        food_type: [
+            {**item, "Total (kg)": item["Grams"] * population} for item in items
+        ] for food_type, items in best_iteration["Meal Plan (grams per type)"].items()
+    } if best_iteration else {}
 
-    # Ensure we have a best iteration based on the highest average coverage score
-    if best_iteration is None and all_iterations_results:
-        best_iteration = max(all_iterations_results, key=lambda x: sum(x["Percentage Fulfillment (%)"].values()) / len(x["Percentage Fulfillment (%)"]))
+    # Return the results
+    return all_iterations_results, best_iteration, final_scaled_plan
+
+# Function to compute the exact optimal meal plan, returning the same structure as generate_optimized_meal_plan
+# with a single attempt, and the grams per food item instead of the food indices per slot
+def generate_exact_meal_plan(daily_needs_per_citizen, food_composition, population, food_group_limits=None):
+    """
+    Solve the meal plan exactly as a bounded linear program (see diet_solver.solve_diet): the per capita needs
+    are the targets, and the food group limits cap the grams per FOOD TYPE.
+    Grams are rounded to 0.1g, and food items that are not used are left out of the meal plan.
+    If food_group_limits is None, food_group_calorie_limits is used.
+    """
+    food_group_limits = food_group_limits or food_group_calorie_limits
+    needs_columns = list(daily_needs_per_citizen.columns[2:])
+    matrix = build_needs_matrix(food_composition, needs_columns)
+    group_indices = food_composition.group_indices(food_group_limits)
+    required_amounts = np.array([daily_needs_per_citizen[nutrient].values[0] for nutrient in needs_columns], dtype=float)
+
+    grams = solve_diet(matrix, required_amounts, list(group_indices.values()), np.array(list(food_group_limits.values())))
+    grams = np.round(grams, 1)
+
+    meal_plan = {}
+    for food_type, indices in group_indices.items():
+        items = [{"Food": food_composition.food_names[i], "Grams": float(grams[i])} for i in indices if grams[i] > 0]
+        if items:
+            meal_plan[food_type] = sorted(items, key=lambda item: item["Grams"], reverse=True)
+
+    total_nutrient_amounts = grams @ matrix / 100.0
+    total_nutrients = dict(zip(needs_columns, total_nutrient_amounts.tolist()))
+    best_iteration = {
+        "Iteration": 1,
+        "Meal Plan (grams per type)": meal_plan,
+        "Total Nutrients": total_nutrients,
+        "Percentage Fulfillment (%)": calculate_percentage_met(daily_needs_per_citizen, total_nutrients)
+    }
 
     final_scaled_plan = {
         food_type: [
             {**item, "Total (kg)": item["Grams"] * population} for item in items
-        ] for food_type, items in best_iteration["Meal Plan (grams per type)"].items()
+        ] for food_type, items in meal_plan.items()
+    }
+
+    percentage_met = np.array([list(best_iteration["Percentage Fulfillment (%)"].values())], dtype=float)
+    all_iterations_results = {
+        "Grams": grams[None],
+        "Total Nutrients": total_nutrient_amounts[None],
+        "Percentage Fulfillment (%)": percentage_met,
+        "Average Coverage": percentage_met.mean(axis=1) if percentage_met.size else np.zeros(1)
     }
 
-    # Return the results
     return all_iterations_results, best_iteration, final_scaled_plan
 
+# Function to solve the meal plan of a country and year, memoized so the same plan is only solved once
+@st.cache_data(max_entries=256)
+def solve_meal_plan(country, year, optimization_method, limits, max_foods, max_attempts, seed):
+    """
+    The plans are cached by (country, year, method, food group limits, max foods, max attempts, seed),
+    where limits are the (food type, grams) items of the food group limits the plan is built with.
+    Only the best iteration and the scaled plan are kept
+    """
+    food_group_limits = dict(limits)
+    row = row_index[(country, year)]
+    daily_needs_per_citizen, filtered_needs = per_capita_needs_df.iloc[[row]], nutrient_needs_df.iloc[[row]]
+    if optimization_method == 'Exact optimization':
+        _, best_iteration, final_scaled_plan = generate_exact_meal_plan(
+            daily_needs_per_citizen, food_composition, population_per_row[row], food_group_limits
+        )
+    else:
+        _, best_iteration, final_scaled_plan = generate_optimized_meal_plan(
+            daily_needs_per_citizen, food_composition, max_foods, max_attempts, population_per_row[row],
+            filtered_needs, seed=seed, food_group_limits=food_group_limits
+        )
+    return best_iteration, final_scaled_plan
+
+# Select how the meal plan is optimized
+optimization_method = st.radio('Optimization Method', ['Random sampling', 'Exact optimization'])
+
 # Streamlit UI to generate and display results
 if st.button("Generate Country-Scale Meal Plan"):
-    all_iterations, best_iteration, final_scaled_plan = generate_optimized_meal_plan(
-        daily_needs_per_citizen, food_data_df, max_foods, max_attempts, population, filtered_needs
-    )
+    if row is None:
+        best_iteration, final_scaled_plan = None, {}
+    else:
+        best_iteration, final_scaled_plan = solve_meal_plan(
+            country, year, optimization_method, tuple(food_group_calorie_limits.items()), max_foods, max_attempts,
+            seed
+        )
 
     # Display the best iteration if found
     if best_iteration: